@@ -1,6 +1,9 @@
 import bleak as b
 import asyncio
 import numpy as np
+from os import path, environ, makedirs
+
+from m_teng.backends.arduino.calibration import Calibration, fit, get_calibration, save_calibration
 
 TARGET_NAME = "ArduinoTENG"
 
@@ -19,15 +22,44 @@ TENG_COMMANDS = {
 }
 TENG_STATUS = ["ERROR", "BUSY", "WAIT_CONNECT", "CONNECTED", "MEASURING"]
 
+# readings carry sequence numbers, see sequence.py. Requires a firmware that sends sequenced readings
+SEQUENCED_PROTOCOL = False
+
+# the address of the last connected device is stored here to skip scanning on the next start
+if 'XDG_CACHE_HOME' in environ.keys():
+    ADDRESS_CACHE_PATH = environ["XDG_CACHE_HOME"] + "/m-teng-arduino-address"
+else:
+    ADDRESS_CACHE_PATH = path.expanduser("~/.cache/m-teng-arduino-address")
+
 # TODO save measurements on device buffer, transfer later
 
 
 # wrapper for global variable
 class Buffer:
     def __init__(self):
-        self.data = None
+        self.data = None  # voltage column in volts
+        self.raw = None  # raw ADC readings of the last run
+        self.stats = None  # loss statistics of the last run in sequenced mode
+        self.clock_sync = None  # maps the timestamps of the last run to host time
 _buffer = Buffer()
 
+
+# wrapper for the calibration of the connected device
+class ActiveCalibration:
+    def __init__(self):
+        self.calibration = Calibration()
+_calibration = ActiveCalibration()
+
+
+# wrapper for the global reconnect state
+class Reconnect:
+    def __init__(self):
+        self.enabled = True
+        self.task = None
+        self.n_reconnects = 0  # number of successful reconnects, used by the measurement loops to resume
+        self.failed = False
+_reconnect = Reconnect()
+
 # class Runner:
 #     def __init__(self):
 runner = asyncio.Runner()
@@ -40,14 +72,95 @@ def teng_status_callback(characteristic, data):
         print(f"Status change (invalid): status={value}")
 
 
+def load_cached_address():
+    """
+    @returns: the address of the last connected device or None
+    """
+    if not path.isfile(ADDRESS_CACHE_PATH): return None
+    with open(ADDRESS_CACHE_PATH, "r") as file:
+        address = file.read().strip()
+    return address if address else None
+
+
+def save_cached_address(address: str):
+    try:
+        if not path.isdir(path.dirname(ADDRESS_CACHE_PATH)):
+            makedirs(path.dirname(ADDRESS_CACHE_PATH))
+        with open(ADDRESS_CACHE_PATH, "w") as file:
+            file.write(address)
+    except OSError as e:
+        print(f"Could not cache Bluetooth address: {e}")
+
+
 def disconnect_callback(client):
-    raise Exception(f"The Bluetooth device {client.name} was disconnected")
+    """
+    Schedule a reconnect with backoff. The measurement loops resume once the reconnect succeeded.
+    """
+    if not _reconnect.enabled: return
+    if _reconnect.task is not None and not _reconnect.task.done(): return
+    print(f"The Bluetooth device '{TARGET_NAME}' was disconnected, trying to reconnect" + " "*20)
+    _reconnect.failed = False
+    _reconnect.task = runner.get_loop().create_task(reconnect_async(client))
+
+
+async def reconnect_async(client, n_tries: int=10, delay: float=0.5, max_delay: float=8.0) -> bool:
+    """
+    Try to reconnect the client, doubling the delay after each failed try
+    @param n_tries: maximum number of tries
+    @param delay: delay before the first try, in seconds
+    @param max_delay: upper limit for the delay, in seconds
+    @returns: True if the client is connected again
+    """
+    for n_try in range(n_tries):
+        await asyncio.sleep(delay)
+        if not _reconnect.enabled: return False
+        try:
+            await client.connect()
+            _reconnect.n_reconnects += 1
+            print(f"Reconnected to Bluetooth device '{TARGET_NAME}' at [{client.address}] ({n_try+1}/{n_tries})" + " "*20)
+            return True
+        except (b.exc.BleakError, asyncio.TimeoutError, OSError) as e:
+            print(f"Reconnect failed ({n_try+1}/{n_tries}): {e}" + " "*20, end="\r")
+        delay = min(2 * delay, max_delay)
+    print(f"Could not reconnect to Bluetooth device '{TARGET_NAME}'" + " "*40)
+    _reconnect.failed = True
+    return False
+
+
+def reconnect_failed(client) -> bool:
+    """
+    @returns: True if the client is disconnected and no reconnect is pending anymore
+    """
+    return not client.is_connected and _reconnect.failed
 
 
-async def init_arduino_async(n_tries: int=5) -> b.BleakClient:
+async def connect_cached_async(timeout: float=5.0):
+    """
+    Connect directly to the cached address, without scanning
+    @returns: BleakClient or None if there is no cached address or the connection failed
+    """
+    address = load_cached_address()
+    if address is None: return None
+    print(f"Connecting to cached address [{address}]", end="\r")
+    client = b.BleakClient(address, disconnected_callback=disconnect_callback, timeout=timeout)
+    try:
+        await client.connect()
+    except (b.exc.BleakError, asyncio.TimeoutError, OSError) as e:
+        print(f"Could not connect to cached address [{address}]: {e}")
+        return None
+    return client
+
+
+async def init_arduino_async(n_tries: int=5, use_cache=True) -> b.BleakClient:
     n_try = 0
     if n_tries <= 0: n_tries = "inf"
     try:
+        client = None
+        if use_cache:
+            client = await connect_cached_async()
+        if client is not None:
+            print(f"Connected to Bluetooth device '{TARGET_NAME}' at [{client.address}]")
+            return client
         target_device = None
         while target_device is None and (n_tries == "inf" or n_try < n_tries):
             print(f"Searching for Bluetooth device '{TARGET_NAME}' ({n_try+1}/{n_tries})", end="\r")
@@ -63,25 +176,31 @@ async def init_arduino_async(n_tries: int=5) -> b.BleakClient:
             raise Exception(f"Could not find Bluetooth device 'ArduinoTENG'")
         # print(f"Found target device: {target_device.name}: {target_device.metadata}, {target_device.details}")
         # print(target_device.name, target_device.details)
-        client = b.BleakClient(target_device, disconnect_callback=disconnect_callback)
+        client = b.BleakClient(target_device, disconnected_callback=disconnect_callback)
         await client.connect()
+        save_cached_address(client.address)
         print(f"Connected to Bluetooth device '{TARGET_NAME}' at [{client.address}]")
         return client
     except asyncio.exceptions.CancelledError:
         raise Exception(f"Cancelled")
 
 
-def init(beep_success=True, n_tries: int=5) -> b.BleakClient:
+def init(beep_success=True, n_tries: int=5, use_cache=True) -> b.BleakClient:
     """
     Connect to the arduino
+    @param use_cache: try the address of the last connected device before scanning
     @returns: BleakClient
     """
-    client = runner.run(init_arduino_async(n_tries=n_tries))
+    _reconnect.enabled = True
+    client = runner.run(init_arduino_async(n_tries=n_tries, use_cache=use_cache))
+    _calibration.calibration = get_calibration(client.address)
+    print(f"Using {_calibration.calibration}")
     if beep_success: beep(client)
     return client
 
 
 def exit(client):
+    _reconnect.enabled = False
     try:
         runner.run(stop_measurement(client))
         runner.run(client.disconnect())
@@ -142,6 +261,33 @@ async def start_measure(client):
 #     print("Disconnected")
 
 
+def set_calibration(client, calibration: Calibration, save=True):
+    """
+    Use a calibration for the connected device
+    @param save: store the calibration for the address of the device, so that it is loaded by init
+    """
+    _calibration.calibration = calibration
+    if save:
+        save_calibration(client.address, calibration)
+
+
+def fit_calibration(raw, voltage, degree=1):
+    """
+    Fit a calibration to readings of known reference voltages, use it with set_calibration
+    @param raw: raw ADC readings, eg _buffer.raw
+    @param voltage: reference voltages
+    @returns: Calibration
+    """
+    return fit(raw, voltage, degree=degree)
+
+
+def calibrate(raw):
+    """
+    Convert raw ADC readings to volts using the calibration of the connected device
+    """
+    return _calibration.calibration.apply(raw)
+
+
 def collect_buffer(instr, buffer_nr=1):
     """
     @param buffer_nr: 1 -> current, 2 -> voltage
@@ -150,6 +296,14 @@ def collect_buffer(instr, buffer_nr=1):
     return np.vstack((_buffer.data[:,0], _buffer.data[:,buffer_nr])).T
 
 
+def get_clock_sync(client):
+    """
+    The timestamps are taken by the host when a reading arrives, so the mapping to host time is a fixed offset
+    @returns: ClockSync of the last measurement or None
+    """
+    return _buffer.clock_sync
+
+
 def beep(client):
     # TODO connect beeper to arduino?
     print("beep")
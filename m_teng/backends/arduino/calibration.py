@@ -0,0 +1,116 @@
+"""
+Convert raw ADC readings of the Arduino to volts
+
+A calibration consists of gain and offset, optional higher order polynomial terms and an optional lookup table:
+    voltage = offset + gain * raw + poly[0] * raw^2 + poly[1] * raw^3 + ...
+If a lookup table is given, it is used instead and values between its points are interpolated linearly.
+
+Calibrations are stored per device address in a json file.
+"""
+import json
+from os import path, environ, makedirs
+
+import numpy as np
+
+# 12 bit ADC with 3.3 V reference
+ADC_MAX = 4095
+V_REF = 3.3
+
+if 'XDG_CONFIG_HOME' in environ.keys():
+    CALIBRATION_PATH = environ["XDG_CONFIG_HOME"] + "/m-teng-arduino-calibration.json"
+else:
+    CALIBRATION_PATH = path.expanduser("~/.config/m-teng-arduino-calibration.json")
+
+
+class Calibration:
+    """
+    @param gain: volts per ADC count
+    @param offset: volts at raw = 0
+    @param poly: coefficients of raw^2, raw^3, ...
+    @param lut: list of (raw, voltage) points, sorted by raw
+    """
+    def __init__(self, gain=V_REF/ADC_MAX, offset=0.0, poly=None, lut=None):
+        self.gain = gain
+        self.offset = offset
+        # poly and lut can be numpy arrays, which have no truth value
+        self.poly = [ float(c) for c in poly ] if poly is not None and len(poly) > 0 else []
+        self.lut = None
+        if lut is not None and len(lut) > 0:
+            lut = np.array(lut, dtype=float)
+            self.lut = lut[np.argsort(lut[:,0])]
+        self._coefficients = np.array([offset, gain] + self.poly, dtype=float)
+
+    def apply(self, raw):
+        """
+        Works with scalars and arrays. NaN stays NaN.
+        @returns: raw converted to volts
+        """
+        if self.lut is not None:
+            return np.interp(raw, self.lut[:,0], self.lut[:,1])
+        if not self.poly:
+            return self.offset + self.gain * raw
+        return np.polynomial.polynomial.polyval(raw, self._coefficients)
+
+    def to_dict(self):
+        return {
+            "gain": self.gain,
+            "offset": self.offset,
+            "poly": self.poly,
+            "lut": self.lut.tolist() if self.lut is not None else None,
+        }
+
+    @staticmethod
+    def from_dict(d):
+        return Calibration(gain=d.get("gain", V_REF/ADC_MAX), offset=d.get("offset", 0.0), poly=d.get("poly"), lut=d.get("lut"))
+
+    def __repr__(self):
+        s = f"Calibration(gain={self.gain:.6g}, offset={self.offset:.6g}"
+        if self.poly: s += f", poly={self.poly}"
+        if self.lut is not None: s += f", lut with {len(self.lut)} points"
+        return s + ")"
+
+
+def fit(raw, voltage, degree=1):
+    """
+    Fit a calibration to readings of known reference voltages
+    @param raw: raw ADC readings
+    @param voltage: reference voltages
+    @param degree: degree of the polynomial, at least 1
+    @returns: Calibration
+    """
+    if degree < 1: raise ValueError(f"Invalid degree: {degree}, must be at least 1")
+    coefficients = np.polynomial.polynomial.polyfit(np.asarray(raw, dtype=float), np.asarray(voltage, dtype=float), degree)
+    return Calibration(gain=float(coefficients[1]), offset=float(coefficients[0]), poly=[ float(c) for c in coefficients[2:] ])
+
+
+def load_calibrations():
+    """
+    @returns: dict: address -> Calibration
+    """
+    if not path.isfile(CALIBRATION_PATH): return {}
+    with open(CALIBRATION_PATH, "r") as file:
+        content = json.load(file)
+    return { address: Calibration.from_dict(d) for address, d in content.items() }
+
+
+def get_calibration(address: str):
+    """
+    @returns: the stored calibration of the device or the default calibration
+    """
+    try:
+        return load_calibrations().get(address, Calibration())
+    except (OSError, ValueError) as e:
+        print(f"ERROR: get_calibration: Could not load calibrations from '{CALIBRATION_PATH}': {e}")
+        return Calibration()
+
+
+def save_calibration(address: str, calibration: Calibration):
+    """
+    Store the calibration of the device, replacing a previous one
+    """
+    calibrations = load_calibrations()
+    calibrations[address] = calibration
+    if not path.isdir(path.dirname(CALIBRATION_PATH)):
+        makedirs(path.dirname(CALIBRATION_PATH))
+    with open(CALIBRATION_PATH, "w") as file:
+        json.dump({ a: c.to_dict() for a, c in calibrations.items() }, file, indent=1)
@@ -2,74 +2,183 @@ import bleak as b
 import numpy as np
 
 import asyncio
-import datetime
 
-from m_teng.backends.arduino.arduino import beep, set_interval, set_count, TENG_READING_CUUID, _buffer, start_measure, start_measure_count, stop_measurement, runner
+from m_teng.backends.arduino import arduino
+from m_teng.backends.arduino.arduino import beep, calibrate, set_interval, set_count, TENG_READING_CUUID, _buffer, _reconnect, reconnect_failed, start_measure, start_measure_count, stop_measurement, runner
+from m_teng.backends.arduino.sequence import SequenceTracker, parse_records
+from m_teng.utility import tracing
+from m_teng.utility import timing
 
 
-async def _measure_count_async(client, count=100, interval=0.05, update_func=None, update_interval=0.5, beep_done=True, verbose=True):
+def _traced_callback(callback):
+    async def wrapper(characteristic, data):
+        with tracing.span("notification", "arduino"):
+            await callback(characteristic, data)
+    return wrapper
+
+
+async def _measure_count_async(client, count=100, interval=0.05, update_func=None, update_interval=0.5, beep_done=True, verbose=True, sequenced=False):
     global _buffer
-    _buffer.data = np.zeros((count, 3))
+    update_func = tracing.traced(update_func, "update_func")
     i = 0
-    t_start = datetime.datetime.now()
+    t_start = timing.now()
+    _buffer.clock_sync = timing.ClockSync(offset=t_start)
+    tracker = SequenceTracker() if sequenced else None
+    if sequenced:
+        # rows of lost samples stay NaN
+        _buffer.data = np.full((count, 3), np.nan)
+    else:
+        _buffer.data = np.zeros((count, 3))
+    _buffer.stats = None
+    loop = asyncio.get_running_loop()
+    t_last_reading = loop.time()
+
     async def add_reading(teng_reading_cr, reading: bytearray):
-        nonlocal i, count
+        nonlocal i, count, t_last_reading
         if i >= count: return
-        _buffer.data[i][0] = float((datetime.datetime.now() - t_start).microseconds) / 1000
+        t_last_reading = loop.time()
+        t = timing.now() - t_start
+        if sequenced:
+            records = parse_records(reading)
+            tracker.add_notification(len(records))
+            for seq, value in records:
+                index, n_missing = tracker.add(seq)
+                if index is None or index >= count: continue
+                _buffer.data[index] = (t, 0, value)
+                i = index + 1
+            return
+        _buffer.data[i][0] = t
         # reading = await client.read_gatt_char(TENG_READING_CUUID)
         _buffer.data[i][2] = int.from_bytes(reading, byteorder="little", signed=False)
         i += 1
 
-    await set_interval(client, interval)
-    await set_count(client, count)
-    # TODO check if notify works when the same value is written again
-    await client.start_notify(TENG_READING_CUUID, add_reading)
-    await start_measure_count(client)
+    async def start():
+        await set_interval(client, interval)
+        await set_count(client, count - i)
+        # TODO check if notify works when the same value is written again
+        await client.start_notify(TENG_READING_CUUID, _traced_callback(add_reading))
+        await start_measure_count(client)
+
+    await start()
+    n_reconnects = _reconnect.n_reconnects
+    # in sequenced mode, the last samples might never arrive
+    idle_timeout = max(2.0, 20 * interval)
     while i < count:
         await asyncio.sleep(update_interval)
+        if _reconnect.n_reconnects != n_reconnects:
+            # the device was reconnected, continue with the remaining measurements
+            n_reconnects = _reconnect.n_reconnects
+            print(f"Resuming measurement at n = {i}" + " "*30)
+            if sequenced: tracker.resume()
+            await start()
+        elif reconnect_failed(client):
+            print(f"Connection lost, keeping the first {i} measurements" + " "*30)
+            _buffer.data = _buffer.data[:i]
+            break
+        elif sequenced and loop.time() - t_last_reading > idle_timeout:
+            print(f"No readings for {idle_timeout}s, marking the last {count - i} samples as lost" + " "*30)
+            tracker.mark_lost(count - i)
+            break
         if update_func is not None and i > 0:  # assume an update has occured
-            update_func(i-1, 0, _buffer.data[i-1, 2])
-    await client.stop_notify(TENG_READING_CUUID)
+            update_func(i-1, 0, calibrate(_buffer.data[i-1, 2]))
+    if client.is_connected:
+        await client.stop_notify(TENG_READING_CUUID)
+    _buffer.raw = _buffer.data[:,2].copy()
+    _buffer.data[:,2] = calibrate(_buffer.raw)
+    if sequenced:
+        _buffer.stats = tracker.stats()
+        if verbose: tracker.print_stats()
     if beep_done: beep(client)
 
-def measure_count(client, count=100, interval=0.05, update_func=None, update_interval=0.5, beep_done=True, verbose=True):
-    runner.run(_measure_count_async(client, count=count, interval=interval, update_func=update_func, update_interval=update_interval, beep_done=beep_done, verbose=verbose))
+def measure_count(client, count=100, interval=0.05, update_func=None, update_interval=0.5, beep_done=True, verbose=True, sequenced=None):
+    """
+    @param sequenced: use the sequenced reading protocol, which detects lost samples. None means arduino.SEQUENCED_PROTOCOL
+    """
+    if sequenced is None: sequenced = arduino.SEQUENCED_PROTOCOL
+    runner.run(_measure_count_async(client, count=count, interval=interval, update_func=update_func, update_interval=update_interval, beep_done=beep_done, verbose=verbose, sequenced=sequenced))
 
 
-async def _measure_async(client, interval, update_func=None, max_measurements=None):
+async def _measure_async(client, interval, update_func=None, max_measurements=None, sequenced=False):
     global _buffer
+    update_func = tracing.traced(update_func, "update_func")
     readings = []
     timestamps = []
     i = 0
-    t_start = datetime.datetime.now()
-
-    async def add_reading(teng_reading_cr, reading):
-        nonlocal i
-        timestamps.append(float((datetime.datetime.now() - t_start).microseconds) / 1000)
-        reading = int.from_bytes(reading, byteorder="little", signed=False)
-        readings.append(reading)
+    t_start = timing.now()
+    _buffer.clock_sync = timing.ClockSync(offset=t_start)
+    tracker = SequenceTracker() if sequenced else None
+    _buffer.stats = None
 
+    def call_update_func(reading):
         if update_func:
             try:
-                update_func(i, 0, reading)
+                update_func(i, 0, calibrate(reading))
             except KeyboardInterrupt:
                 raise asyncio.exceptions.CancelledError("KeyboardInterrupt in update_func")
+
+    async def add_reading(teng_reading_cr, reading):
+        nonlocal i
+        t = timing.now() - t_start
+        if sequenced:
+            records = parse_records(reading)
+            tracker.add_notification(len(records))
+            for seq, value in records:
+                index, n_missing = tracker.add(seq)
+                if index is None: continue
+                # mark lost samples explicitly
+                timestamps.extend([np.nan] * n_missing)
+                readings.extend([np.nan] * n_missing)
+                i += n_missing
+                timestamps.append(t)
+                readings.append(value)
+                call_update_func(value)
+                i += 1
+            return
+        timestamps.append(t)
+        reading = int.from_bytes(reading, byteorder="little", signed=False)
+        readings.append(reading)
+        call_update_func(reading)
         i += 1
 
-    await set_interval(client, interval)
-    await client.start_notify(TENG_READING_CUUID, add_reading)
-    await start_measure(client)
+    async def start():
+        await set_interval(client, interval)
+        await client.start_notify(TENG_READING_CUUID, _traced_callback(add_reading))
+        await start_measure(client)
+
+    await start()
+    n_reconnects = _reconnect.n_reconnects
     try:
         while max_measurements is None or i < max_measurements:
             await asyncio.sleep(0.1)  # 
+            if _reconnect.n_reconnects != n_reconnects:
+                # the device was reconnected, continue the measurement and keep the data
+                n_reconnects = _reconnect.n_reconnects
+                print(f"Resuming measurement at n = {i}" + " "*30)
+                if sequenced: tracker.resume()
+                await start()
+            elif reconnect_failed(client):
+                print(f"Connection lost, keeping the first {i} measurements" + " "*30)
+                break
     except asyncio.exceptions.CancelledError:
         pass
     except KeyboardInterrupt:
         pass
-    await client.stop_notify(TENG_READING_CUUID)
-    await stop_measurement(client)
-    _buffer.data = np.vstack((timestamps, np.zeros(len(timestamps)), readings)).T
+    if client.is_connected:
+        await client.stop_notify(TENG_READING_CUUID)
+        await stop_measurement(client)
+    currents = np.zeros(len(timestamps))
+    _buffer.raw = np.array(readings, dtype=float)
+    if sequenced:
+        currents[np.isnan(_buffer.raw)] = np.nan
+    _buffer.data = np.vstack((timestamps, currents, calibrate(_buffer.raw))).T
     print("Measurement stopped" + " "*50)
+    if sequenced:
+        _buffer.stats = tracker.stats()
+        tracker.print_stats()
 
-def measure(client, interval, update_func=None, max_measurements=None):
-    runner.run(_measure_async(client, interval=interval, update_func=update_func, max_measurements=max_measurements))
+def measure(client, interval, update_func=None, max_measurements=None, sequenced=None):
+    """
+    @param sequenced: use the sequenced reading protocol, which detects lost samples. None means arduino.SEQUENCED_PROTOCOL
+    """
+    if sequenced is None: sequenced = arduino.SEQUENCED_PROTOCOL
+    runner.run(_measure_async(client, interval=interval, update_func=update_func, max_measurements=max_measurements, sequenced=sequenced))
@@ -0,0 +1,101 @@
+"""
+Host side of the sequenced reading protocol
+
+In sequenced mode, every sample sent by the Arduino is a 4 byte record:
+    bytes 0-1: sequence number (uint16, little endian), wraps around after 65535
+    bytes 2-3: reading (uint16, little endian)
+A single notification may contain several records when the Arduino merges them.
+"""
+
+SEQ_MODULO = 2**16
+RECORD_SIZE = 4
+
+
+def parse_records(payload: bytearray):
+    """
+    Split a notification payload into (sequence number, reading) tuples
+    """
+    if len(payload) % RECORD_SIZE != 0:
+        raise ValueError(f"Invalid payload length for sequenced protocol: {len(payload)}")
+    records = []
+    for j in range(0, len(payload), RECORD_SIZE):
+        seq = int.from_bytes(payload[j:j+2], byteorder="little", signed=False)
+        reading = int.from_bytes(payload[j+2:j+4], byteorder="little", signed=False)
+        records.append((seq, reading))
+    return records
+
+
+class SequenceTracker:
+    """
+    Unwrap sequence numbers to absolute sample indices and count lost and duplicate samples
+    """
+    def __init__(self):
+        self.last_index = None  # absolute index of the last accepted sample
+        self.offset = 0  # absolute index of sequence number 0 of the current device run
+        self.restarted = False
+        self.n_received = 0
+        self.n_lost = 0
+        self.n_duplicates = 0
+        self.n_notifications = 0
+        self.n_merged = 0  # notifications that contained more than one record
+
+    def resume(self):
+        """
+        Call when the device restarts its sequence numbers, eg after a reconnect.
+        The next received sample continues right after the last accepted one.
+        """
+        self.offset = 0 if self.last_index is None else self.last_index + 1
+        self.restarted = True
+
+    def add_notification(self, n_records: int):
+        self.n_notifications += 1
+        if n_records > 1: self.n_merged += 1
+
+    def add(self, seq: int):
+        """
+        @param seq: sequence number as received from the device
+        @returns: (index, n_missing)
+            index: absolute index of the sample or None if it is a duplicate
+            n_missing: number of samples that were lost right before this one
+        """
+        if self.last_index is None or self.restarted:
+            self.restarted = False
+            index = self.offset + seq
+            n_missing = index - (0 if self.last_index is None else self.last_index + 1)
+        else:
+            # choose the candidate closest to the last index
+            base = self.last_index - (self.last_index - self.offset) % SEQ_MODULO
+            index = base + seq
+            if index - self.last_index > SEQ_MODULO // 2:
+                index -= SEQ_MODULO
+            elif self.last_index - index >= SEQ_MODULO // 2:
+                index += SEQ_MODULO
+            if index <= self.last_index:
+                self.n_duplicates += 1
+                return None, 0
+            n_missing = index - self.last_index - 1
+        self.n_lost += n_missing
+        self.n_received += 1
+        self.last_index = index
+        return index, n_missing
+
+    def mark_lost(self, n: int):
+        """
+        Count <n> samples at the end of a run as lost
+        """
+        self.n_lost += n
+
+    def stats(self) -> dict:
+        n_expected = self.n_received + self.n_lost
+        return {
+            "received":         self.n_received,
+            "lost":             self.n_lost,
+            "duplicates":       self.n_duplicates,
+            "notifications":    self.n_notifications,
+            "merged":           self.n_merged,
+            "loss_rate":        self.n_lost / n_expected if n_expected > 0 else 0.0,
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Received {s['received']} samples, lost {s['lost']} ({100*s['loss_rate']:.2f}%), {s['duplicates']} duplicates, {s['merged']}/{s['notifications']} merged notifications")
@@ -0,0 +1,105 @@
+import asyncio
+import random
+
+import numpy as np
+
+from m_teng.backends.arduino.arduino import TENG_COMMAND_CUUID, TENG_COUNT_CUUID, TENG_INTERVAL_CUUID, TENG_READING_CUUID, TENG_COMMANDS
+from m_teng.backends.arduino.sequence import SEQ_MODULO
+from m_teng.utility.testing import get_testcurve
+
+
+class FakeBleakClient:
+    """
+    Stand-in for a BleakClient connected to the ArduinoTENG, for trying the arduino measurement functions without the device
+
+    @details
+        Answers the same GATT writes as the firmware and sends test curve readings as notifications.
+        Notifications can be dropped, duplicated and merged at random to simulate an unreliable BLE link.
+        The sent sequence numbers are stored in self.sent and the ones of the samples that actually arrived
+        in self.delivered, so that the statistics of a run can be checked.
+    @param sequenced: send readings with sequence numbers, see sequence.py
+    @param p_drop: probability that a notification is dropped
+    @param p_duplicate: probability that a notification is sent twice
+    @param p_merge: probability that a reading is merged into the next notification (sequenced only)
+    """
+    def __init__(self, sequenced=True, p_drop=0.0, p_duplicate=0.0, p_merge=0.0, seed=None):
+        self.address = "00:00:00:00:00:00"
+        self.name = "FakeArduinoTENG"
+        self.is_connected = True
+        self.sequenced = sequenced
+        self.p_drop = p_drop
+        self.p_duplicate = p_duplicate
+        self.p_merge = p_merge
+        self.random = random.Random(seed)
+        self.interval = 0.01
+        self.count = 0
+        self.callback = None
+        self.task = None
+        self.sent = []
+        self.delivered = []
+        self.curve = get_testcurve(frequency=1, peak_width=0.2, amplitude=1000, bias=2000)
+
+    async def connect(self):
+        self.is_connected = True
+
+    async def disconnect(self):
+        self._stop()
+        self.is_connected = False
+
+    async def start_notify(self, uuid, callback):
+        assert(uuid == TENG_READING_CUUID)
+        self.callback = callback
+
+    async def stop_notify(self, uuid):
+        self.callback = None
+
+    async def write_gatt_char(self, uuid, data):
+        if uuid == TENG_INTERVAL_CUUID:
+            self.interval = int.from_bytes(data, byteorder="little", signed=False) / 1000
+        elif uuid == TENG_COUNT_CUUID:
+            self.count = int.from_bytes(data, byteorder="little", signed=False)
+        elif uuid == TENG_COMMAND_CUUID:
+            self._stop()
+            if data == TENG_COMMANDS["MEASURE_COUNT"]:
+                self.task = asyncio.get_running_loop().create_task(self._send(self.count))
+            elif data == TENG_COMMANDS["MEASURE"]:
+                self.task = asyncio.get_running_loop().create_task(self._send(None))
+
+    def _stop(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.task = None
+
+    async def _notify(self, payload: bytes, seqs):
+        if self.callback is None: return
+        self.delivered.extend(seqs)
+        result = self.callback(None, bytearray(payload))
+        if asyncio.iscoroutine(result):
+            await result
+
+    async def _send(self, count):
+        pending = b""
+        pending_seqs = []
+        seq = 0
+        while count is None or seq < count:
+            await asyncio.sleep(self.interval)
+            value = int(np.clip(self.curve(seq * self.interval), 0, 4095))
+            self.sent.append(seq)
+            if not self.sequenced:
+                payload = value.to_bytes(2, byteorder="little", signed=False)
+                seqs = [seq]
+            else:
+                pending += (seq % SEQ_MODULO).to_bytes(2, byteorder="little", signed=False) + value.to_bytes(2, byteorder="little", signed=False)
+                pending_seqs.append(seq)
+                seq += 1
+                if self.random.random() < self.p_merge and (count is None or seq < count):
+                    continue
+                payload, pending = pending, b""
+                seqs, pending_seqs = pending_seqs, []
+            if not self.sequenced:
+                seq += 1
+            if self.random.random() < self.p_drop:
+                continue
+            await self._notify(payload, seqs)
+            if self.random.random() < self.p_duplicate:
+                await self._notify(payload, seqs)
@@ -1,7 +1,11 @@
 import pyvisa
 import numpy as np
+from time import sleep
 import pkg_resources
 
+from m_teng.utility import tracing
+from m_teng.utility.timing import ClockSync
+
 
 """
 Utility
@@ -10,8 +14,112 @@ Utility
 scripts = {
     "buffer_reset": pkg_resources.resource_filename("m_teng", "keithley_scripts/buffer_reset.lua"),
     "smua_reset":   pkg_resources.resource_filename("m_teng", "keithley_scripts/smua_reset.lua"),
+    "stream_setup": pkg_resources.resource_filename("m_teng", "keithley_scripts/stream_setup.lua"),
 }
 
+"""
+Speed profiles
+"""
+
+# min_interval: estimated shortest measurement interval in seconds, replaced by the result of probe_profile
+# rangev, rangei: fixed measurement ranges in V and A when autorange is off, the SMU uses the smallest range that contains them.
+#   Larger values are clipped to the range, so they must be above the peaks of the TENG
+SPEED_PROFILES = {
+    "precise":  { "nplc": 1,     "autorange": True,  "rangev": None, "rangei": None, "autozero": "AUTO", "display": True,  "min_interval": 0.05 },
+    "balanced": { "nplc": 0.1,   "autorange": True,  "rangev": None, "rangei": None, "autozero": "ONCE", "display": True,  "min_interval": 0.005 },
+    "max-rate": { "nplc": 0.001, "autorange": False, "rangev": 200,  "rangei": 1e-4, "autozero": "OFF",  "display": False, "min_interval": 0.0005 },
+}
+
+# wrapper for global variables
+class Profile:
+    def __init__(self):
+        self.name = None  # None means the settings from smua_reset.lua
+        self.probed = {}  # profile name -> measured interval
+_profile = Profile()
+
+
+# wrapper for the clock sync of the last measurement
+class Sync:
+    def __init__(self):
+        self.clock_sync = None
+        self.buffer_base = 0.0  # timer value of the first reading, the buffer timestamps are relative to it
+_sync = Sync()
+
+
+def set_profile(name):
+    """
+    Set the speed profile that is applied after every reset
+    @param name: key of SPEED_PROFILES or None for the settings from smua_reset.lua
+    """
+    if name is not None and name not in SPEED_PROFILES:
+        raise ValueError(f"Invalid profile: '{name}', must be one of {list(SPEED_PROFILES.keys())}")
+    _profile.name = name
+
+
+def apply_profile(instr, name, verbose=False):
+    """
+    Write the settings of a speed profile to smua
+    """
+    profile = SPEED_PROFILES[name]
+    if verbose: print(f"Applying speed profile '{name}'")
+    commands = [f"smua.measure.nplc = {profile['nplc']}"]
+    if profile["autorange"]:
+        commands += ["smua.measure.autorangev = smua.AUTORANGE_ON", "smua.measure.autorangei = smua.AUTORANGE_ON"]
+    else:
+        commands += ["smua.measure.autorangev = smua.AUTORANGE_OFF", f"smua.measure.rangev = {profile['rangev']}"]
+        commands += ["smua.measure.autorangei = smua.AUTORANGE_OFF", f"smua.measure.rangei = {profile['rangei']}"]
+    commands.append(f"smua.measure.autozero = smua.AUTOZERO_{profile['autozero']}")
+    if profile["display"]:
+        commands.append("display.screen = display.SMUA")
+    else:
+        # the user screen is not updated while measuring
+        commands += ["display.screen = display.USER", "display.clear()", f"display.settext('m-teng {name}')"]
+    instr.write("\n".join(commands))
+
+
+def get_min_interval(name=None):
+    """
+    @returns: shortest interval the profile can deliver in seconds, measured if probe_profile was run and estimated otherwise
+    """
+    if name is None: name = _profile.name
+    if name is None: name = "precise"
+    return _profile.probed.get(name, SPEED_PROFILES[name]["min_interval"])
+
+
+def probe_profile(instr, name, count=200, verbose=True):
+    """
+    Measure the shortest achievable interval of a speed profile
+
+    @details
+        Runs an overlapped measurement with interval 0, which measures as fast as possible,
+        and takes the median time between the readings.
+    @returns: achievable interval in seconds
+    """
+    reset(instr, verbose=False)
+    apply_profile(instr, name)
+    instr.write(f"smua.measure.count = {count}")
+    instr.write("smua.measure.interval = 0")
+    instr.write("smua.source.output = smua.OUTPUT_ON")
+    instr.write("smua.measure.overlappediv(smua.nvbuffer1, smua.nvbuffer2)")
+    while float(instr.query("print(status.operation.measuring.condition)").strip("\n ")) != 0:
+        sleep(0.1)
+    instr.write("smua.source.output = smua.OUTPUT_OFF")
+    timestamps = collect_buffer(instr, buffer_nr=1)[:,0]
+    interval = float(np.median(np.diff(timestamps)))
+    _profile.probed[name] = interval
+    if verbose: print(f"{name:10s}: {interval*1000:8.3f} ms ({1/interval:8.1f} Hz)")
+    return interval
+
+
+def probe_profiles(instr, count=200):
+    """
+    Measure the shortest achievable interval of all speed profiles
+    @returns: dict: profile name -> interval in seconds
+    """
+    results = { name: probe_profile(instr, name, count=count) for name in SPEED_PROFILES.keys() }
+    reset(instr)
+    return results
+
 
 def init(beep_success=True):
     rm = pyvisa.ResourceManager('@py')
@@ -52,11 +160,61 @@ def run_lua(instr, script_path, verbose=False):
 
 def reset(instr, verbose=False):
     """
-    Reset smua and its buffers
+    Reset smua and its buffers and apply the speed profile
     @param instr : pyvisa instrument
     """
     run_lua(instr, scripts["smua_reset"], verbose=verbose)
     run_lua(instr, scripts["buffer_reset"], verbose=verbose)
+    if _profile.name is not None:
+        apply_profile(instr, _profile.name, verbose=verbose)
+
+def query_timer(instr) -> float:
+    """
+    @returns: seconds since the last timer.reset() on the instrument
+    """
+    return float(instr.query("print(timer.measure.t())").strip("\n"))
+
+
+def query_first_reading(instr, buffer_nr=1, timeout=1.0):
+    """
+    Wait on the instrument until a running measurement stored its first reading in the (cleared) buffer
+    @param timeout: maximum time to wait in seconds, must be shorter than the timeout of the instrument
+    @returns: timer value in seconds when the first reading was stored, None after the timeout
+    """
+    buffername = get_buffer_name(buffer_nr)
+    n, t = instr.query(f"local t0 = timer.measure.t() while {buffername}.n == 0 and timer.measure.t() - t0 < {timeout} do end print({buffername}.n, timer.measure.t())").strip("\n").split("\t")
+    if int(float(n)) == 0: return None
+    return float(t)
+
+
+def start_clock_sync(buffer_base=0.0):
+    """
+    Start a new clock sync, call when the instrument timer was reset at the start of a measurement.
+    The buffer timestamps are relative to the first reading (bufferVar.basetimestamp), not to the timer.
+    @param buffer_base: timer value of the first reading, eg from query_first_reading.
+        The sync then maps the buffer timestamps to host time
+    """
+    _sync.clock_sync = ClockSync()
+    _sync.buffer_base = buffer_base
+
+
+def sync_clock(instr, n=10):
+    """
+    Add a batch of round trips to the clock sync of the current measurement and fit it
+    @returns: ClockSync
+    """
+    if _sync.clock_sync is None: start_clock_sync()
+    with tracing.span("sync clock", "keithley"):
+        _sync.clock_sync.measure(lambda: query_timer(instr) - _sync.buffer_base, n)
+    return _sync.clock_sync.fit()
+
+
+def get_clock_sync(instr):
+    """
+    @returns: ClockSync that maps the buffer timestamps of the last measurement to host time, or None
+    """
+    return _sync.clock_sync
+
 
 def get_buffer_name(buffer_nr: int):
     if buffer_nr == 2: return "smua.nvbuffer2"
@@ -82,8 +240,9 @@ def collect_buffer(instr, buffer_nr=1, verbose=False):
     # instr.write("format.data = format.DREAL\nformat.byteorder = format.LITTLEENDIAN")
     # buffer = instr.query_binary_values(f"printbuffer(1, {buffername}.n, {buffername})", datatype='d', container=np.array)
     instr.write("format.data = format.ASCII\nformat.asciiprecision = 7")
-    timestamps = instr.query_ascii_values(f"printbuffer(1, {buffername}.n, {buffername}.timestamps)", container=np.array)
-    readings = instr.query_ascii_values(f"printbuffer(1, {buffername}.n, {buffername}.readings)", container=np.array)
+    with tracing.span("collect_buffer", "keithley", buffer=buffername):
+        timestamps = instr.query_ascii_values(f"printbuffer(1, {buffername}.n, {buffername}.timestamps)", container=np.array)
+        readings = instr.query_ascii_values(f"printbuffer(1, {buffername}.n, {buffername}.readings)", container=np.array)
     if verbose:
         print(f"readings from {buffername}: {readings}, \ntimestamps: {timestamps}")
     buffer = np.vstack((timestamps, readings)).T
@@ -107,8 +266,9 @@ def collect_buffer_range(instr, range_=(1, -1), buffer_nr=1, verbose=False):
     if range_[1] == -1:
         range_ = (range_[0], f"{buffername}.n")
     instr.write("format.data = format.ASCII\nformat.asciiprecision = 7")
-    timestamps = instr.query_ascii_values(f"printbuffer({range_[0]}, {range_[1]}, {buffername}.timestamps)", container=np.array)
-    readings = instr.query_ascii_values(f"printbuffer({range_[0]}, {range_[1]}, {buffername}.readings)", container=np.array)
+    with tracing.span("collect_buffer_range", "keithley", buffer=buffername):
+        timestamps = instr.query_ascii_values(f"printbuffer({range_[0]}, {range_[1]}, {buffername}.timestamps)", container=np.array)
+        readings = instr.query_ascii_values(f"printbuffer({range_[0]}, {range_[1]}, {buffername}.readings)", container=np.array)
     if verbose:
         print(f"readings from {buffername}: {readings}, \ntimestamps: {timestamps}")
     buffer = np.vstack((timestamps, readings)).T
@@ -1,10 +1,31 @@
-from time import sleep
+from time import sleep, perf_counter
 import numpy as np
 from matplotlib import pyplot as plt
 import pyvisa
 
-from m_teng.backends.keithley.keithley import reset
+from m_teng.backends.keithley.keithley import reset, run_lua, scripts, start_clock_sync, sync_clock, query_first_reading
 from m_teng.utility import testing as _testing
+from m_teng.utility import tracing
+from m_teng.utility.data import CSV_HEADER, format_csv_rows
+
+
+def _is_measuring(instr):
+    with tracing.span("query status", "keithley"):
+        # will return 2.0 while measruing
+        return float(instr.query("print(status.operation.measuring.condition)").strip("\n ")) != 0
+
+def _start_clock_sync(instr):
+    """
+    Start the clock sync of a measurement that runs on the instrument, after timer.reset()
+    """
+    # the buffer timestamps are relative to the first reading, which is taken some time after timer.reset()
+    t_first = query_first_reading(instr)
+    if t_first is None:
+        print("WARNING: No reading within 1s, assuming that the buffer timestamps start at timer.reset()")
+        t_first = 0.0
+    start_clock_sync(t_first)
+    sync_clock(instr)
+
 
 def measure_count(instr, count=100, interval=0.05, update_func=None, update_interval=0.5, beep_done=True, verbose=True):
     """
@@ -28,25 +49,27 @@ def measure_count(instr, count=100, interval=0.05, update_func=None, update_inte
     #     print("I and/or V needs to be set to True")
     #     return
 
+    update_func = tracing.traced(update_func, "update_func")
     i = 0
     reset(instr, verbose=verbose)
     instr.write(f"smua.measure.count = {count}")
     instr.write(f"smua.measure.interval = {interval}")
 
-    # start measurement
+    # start measurement, the timer is reset in the same chunk so that the time of the first reading can be related to it
     instr.write(f"smua.source.output = smua.OUTPUT_ON")
-    instr.write(f_meas)
+    instr.write(f"timer.reset() {f_meas}")
+    _start_clock_sync(instr)
 
     sleep(update_interval)
     # for live viewing
     query = """if smua.nvbufferX.n > 0 then print(smua.nvbufferX.readings[smua.nvbufferX.n]) else print(0) end"""
 
-    # will return 2.0 while measruing
-    while float(instr.query("print(status.operation.measuring.condition)").strip("\n ")) != 0:
+    while _is_measuring(instr):
         if update_func:
             try:
-                ival = float(instr.query(query.replace("X", "1")).strip("\n"))
-                vval = float(instr.query(query.replace("X", "2")).strip("\n"))
+                with tracing.span("query readings", "keithley"):
+                    ival = float(instr.query(query.replace("X", "1")).strip("\n"))
+                    vval = float(instr.query(query.replace("X", "2")).strip("\n"))
                 update_func(i, ival, vval)
             except ValueError as e:
                 if i != 0:
@@ -56,6 +79,7 @@ def measure_count(instr, count=100, interval=0.05, update_func=None, update_inte
         sleep(update_interval)
         i += 1
 
+    sync_clock(instr)
     instr.write(f"smua.source.output = smua.OUTPUT_OFF")
 
     if beep_done:
@@ -76,18 +100,156 @@ def measure(instr, interval, update_func=None, max_measurements=None):
     @param update_func: Callable that processes the measurements: (index, ival, vval) -> None
     @param max_measurements : maximum number of measurements. None means infinite
     """
+    update_func = tracing.traced(update_func, "update_func")
     reset(instr, verbose=True)
     instr.write("smua.source.output = smua.OUTPUT_ON")
     instr.write("format.data = format.ASCII\nformat.asciiprecision = 12")
+    query = "print(smua.measure.iv(smua.nvbuffer1, smua.nvbuffer2))"
+    # the buffer timestamps are relative to the first reading, the timer value right after it anchors the clock sync
+    query_first = "timer.reset() local i, v = smua.measure.iv(smua.nvbuffer1, smua.nvbuffer2) print(i, v, timer.measure.t())"
     try:
         i = 0
         while max_measurements is None or i < max_measurements:
-            ival, vval = tuple(float(v) for v in instr.query("print(smua.measure.iv(smua.nvbuffer1, smua.nvbuffer2))").strip('\n').split('\t'))
+            with tracing.span("measure iv", "keithley"):
+                values = tuple(float(v) for v in instr.query(query_first if i == 0 else query).strip('\n').split('\t'))
+            ival, vval = values[:2]
+            if i == 0:
+                start_clock_sync(values[2])
+                sync_clock(instr)
             if update_func:
                 update_func(i, ival, vval)
             sleep(interval)
             i += 1
     except KeyboardInterrupt:
         pass
+    if i > 0: sync_clock(instr)
     instr.write("smua.source.output = smua.OUTPUT_OFF")
     print("Measurement stopped" + " "*50)
+
+
+class _StreamDrain:
+    """
+    Transfers the new readings from the ring buffers on the instrument to the host
+
+    @details
+        In window mode, index 1 is always the oldest reading on the instrument, so the indices of a reading
+        change while measuring. The new readings are therefore identified by their timestamps.
+        The timestamps are relative to the basetimestamp of the buffer. If it moves when the oldest readings
+        are dropped, the timestamps are shifted back to the base of the first drain.
+    """
+    def __init__(self, instr, interval):
+        self.instr = instr
+        self.interval = interval
+        self.base = None
+        self.last_t = -np.inf
+        self.t_last_drain = perf_counter()
+        self.n_gaps = 0
+
+    def _read_last(self, n, k, final):
+        # all values in one command, so that the timestamps and both readings belong together
+        # the newest reading might not be in nvbuffer2 yet, it is read with the next drain
+        end = n if final else n - 1
+        start = max(1, end - k + 1)
+        if end < start: return np.empty((0, 3))
+        values = self.instr.query_ascii_values(f"printbuffer({start}, {end}, smua.nvbuffer1.timestamps, smua.nvbuffer1.readings, smua.nvbuffer2.readings)", container=np.array)
+        return values.reshape((-1, 3))
+
+    def drain(self, final=False):
+        """
+        @param final: set when the measurement was stopped, then the newest reading is read as well
+        @returns 2D array with the new readings: timestamps, current, voltage
+        """
+        n, base = self.instr.query('print(smua.nvbuffer1.n, string.format("%.6f", smua.nvbuffer1.basetimestamp))').strip("\n").split("\t")
+        n, base = int(float(n)), float(base)
+        if self.base is None and n > 0: self.base = base
+        shift = base - self.base if self.base is not None else 0.0
+        t_now = perf_counter()
+        # only transfer the part of the buffer that is expected to be new
+        k = int(1.5 * (t_now - self.t_last_drain) / self.interval) + 10
+        self.t_last_drain = t_now
+        data = self._read_last(n, min(k, n), final)
+        data[:,0] += shift
+        if len(data) > 0 and data[0,0] > self.last_t + 1.5 * self.interval and k < n:
+            data = self._read_last(n, n, final)
+            data[:,0] += shift
+        if len(data) == 0: return data
+        if np.isfinite(self.last_t) and data[0,0] > self.last_t + 1.5 * self.interval:
+            # readings were overwritten before they could be drained
+            self.n_gaps += 1
+            print(f"measure_stream: Gap between t={self.last_t}s and t={data[0,0]}s, decrease drain_interval" + " "*10)
+        data = data[data[:,0] > self.last_t]
+        if len(data) > 0:
+            self.last_t = data[-1,0]
+        return data
+
+
+def measure_stream(instr, interval, max_measurements=None, update_func=None, drain_interval=0.5, filepath=None, verbose=True):
+    """
+    Measure continuously with the instruments timing and transfer the readings to the host while measuring
+
+    @details
+        Unlike measure_count, the number of measurements is not limited by the buffer capacity:
+        The buffers are used as ring buffers and drained every drain_interval.
+        The readings are collected in memory or, if filepath is given, appended to a csv file.
+        The update_func is called with the newest reading after each drain.
+        Stops after max_measurements or on KeyboardInterrupt.
+    @param instr: pyvisa instrument
+    @param interval: interval between measurements, in seconds
+    @param update_func: Callable that processes the measurements: (index, ival, vval) -> None
+    @param drain_interval: interval at which the buffers are transferred to the host, must be shorter than the time it takes to fill a buffer
+    @param filepath: csv file to write the readings to. None means keep them in memory
+    @returns 2D numpy array: timestamps, current, voltage. None if filepath is given
+    """
+    update_func = tracing.traced(update_func, "update_func")
+    reset(instr, verbose=verbose)
+    run_lua(instr, scripts["stream_setup"], verbose=verbose)
+    instr.write(f"trigger.timer[1].delay = {interval}")
+    instr.write("format.data = format.ASCII\nformat.asciiprecision = 12")
+    capacity = int(float(instr.query("print(smua.nvbuffer1.capacity)").strip("\n")))
+    if verbose and drain_interval > 0.5 * capacity * interval:
+        print(f"measure_stream: drain_interval={drain_interval}s is too long for a buffer capacity of {capacity} readings")
+
+    chunks = []
+    file = None
+    if filepath is not None:
+        file = open(filepath, "wb")
+        file.write(CSV_HEADER.encode())
+    def store(data):
+        if file is not None:
+            file.write(format_csv_rows(data))
+        else:
+            chunks.append(data)
+
+    stream = _StreamDrain(instr, interval)
+    n = 0
+    instr.write("smua.source.output = smua.OUTPUT_ON")
+    instr.write("timer.reset() smua.trigger.initiate()")
+    _start_clock_sync(instr)
+    try:
+        while max_measurements is None or n < max_measurements:
+            sleep(drain_interval)
+            with tracing.span("drain", "keithley"):
+                data = stream.drain()
+            if max_measurements is not None:
+                data = data[:max_measurements - n]
+            if len(data) == 0: continue
+            with tracing.span("store", "save"):
+                store(data)
+            n += len(data)
+            if update_func:
+                update_func(n-1, data[-1,1], data[-1,2])
+    except KeyboardInterrupt:
+        pass
+    instr.write("smua.abort()")
+    sync_clock(instr)
+    if max_measurements is None:
+        data = stream.drain(final=True)
+        store(data)
+        n += len(data)
+    instr.write("smua.source.output = smua.OUTPUT_OFF")
+    if verbose:
+        print(f"Measurement stopped after {n} measurements, {stream.n_gaps} gaps" + " "*30)
+    if file is not None:
+        file.close()
+        return None
+    return np.vstack(chunks) if chunks else np.empty((0, 3))
@@ -0,0 +1,125 @@
+from time import sleep, perf_counter
+
+import numpy as np
+
+from m_teng.backends.replay.replay import reset, beep
+from m_teng.utility import tracing
+
+
+class _Consumer:
+    """
+    Wraps an update_func and measures the time spent in it
+    """
+    def __init__(self, func):
+        self.func = func
+        if hasattr(func, "__self__"):  # bound method, eg _Monitor.update
+            self.name = f"{type(func.__self__).__name__}.{func.__name__}"
+        else:
+            self.name = getattr(func, "__qualname__", repr(func))
+        self.n_calls = 0
+        self.t_total = 0.0
+
+    def __call__(self, i, ival, vval):
+        t = perf_counter()
+        with tracing.span(self.name, "update_func"):
+            self.func(i, ival, vval)
+        self.t_total += perf_counter() - t
+        self.n_calls += 1
+
+    def stats(self):
+        return {
+            "calls": self.n_calls,
+            "time": self.t_total,
+            "calls_per_s": self.n_calls / self.t_total if self.t_total > 0 else float("inf"),
+        }
+
+
+def _replay(dev, count, update_func, update_interval, verbose):
+    """
+    Replay the first <count> samples of dev, paced by the recorded timestamps divided by dev.speed
+    @param update_func: Callable or list of Callables: (index, ival, vval) -> None
+    @param update_interval: recorded time between two calls of the update funcs, None means every sample
+    """
+    if update_func is None: update_func = []
+    elif callable(update_func): update_func = [update_func]
+    consumers = [ _Consumer(func) for func in update_func ]
+    reset(dev)
+    if count is None or count > len(dev.data):
+        if count is not None and verbose:
+            print(f"The recordings only have {len(dev.data)} samples, replaying all of them")
+        count = len(dev.data)
+    data = dev.data
+    # lost samples of sequenced arduino recordings have NaN timestamps, they are replayed without pacing
+    finite = np.flatnonzero(np.isfinite(data[:count,0]))
+    t0_rec = data[finite[0],0] if len(finite) > 0 else 0.0
+    t_next_update = t0_rec
+    max_lag = 0.0
+    t_start = perf_counter()
+    k = 0
+    try:
+        while k < count:
+            t_rec = data[k,0]
+            if dev.speed > 0 and not np.isnan(t_rec):
+                delay = t_start + (t_rec - t0_rec) / dev.speed - perf_counter()
+                if delay > 0: sleep(delay)
+                else: max_lag = max(max_lag, -delay)
+            dev.n = k + 1
+            if update_interval is None or t_rec >= t_next_update:
+                if update_interval is not None: t_next_update = t_rec + update_interval
+                ival, vval = float(data[k,1]), float(data[k,2])
+                for consumer in consumers:
+                    consumer(k, ival, vval)
+            k += 1
+    except KeyboardInterrupt:
+        pass
+    duration = perf_counter() - t_start
+    dev.stats = {
+        "samples": k,
+        "duration": duration,
+        "recorded_duration": float(np.nanmax(data[:k,0]) - t0_rec) if len(finite) > 0 and finite[0] < k else 0.0,
+        "samples_per_s": k / duration if duration > 0 else float("inf"),
+        "max_lag": max_lag,  # how far the replay fell behind the requested speed, in seconds
+        "consumers": { consumer.name: consumer.stats() for consumer in consumers },
+    }
+    if verbose: print_stats(dev.stats)
+
+
+def print_stats(stats):
+    """
+    Print the throughput of a replay
+    @param stats: dev.stats
+    """
+    print(f"Replayed {stats['samples']} samples ({stats['recorded_duration']:.2f}s recorded) in {stats['duration']:.2f}s: {stats['samples_per_s']:.0f} samples/s, max lag {stats['max_lag']*1000:.1f}ms" + " "*20)
+    for name, s in stats["consumers"].items():
+        mean = s["time"] / s["calls"] * 1000 if s["calls"] > 0 else 0
+        print(f"\t{name}: {s['calls']} calls, {mean:.3f}ms per call, sustains {s['calls_per_s']:.0f} calls/s")
+
+
+def measure_count(dev, count=100, interval=0.05, update_func=None, update_interval=0.5, beep_done=True, verbose=True):
+    """
+    Replay <count> samples
+
+    @details
+        The timing is taken from the recording, interval is ignored.
+        Like the keithley backend, the update_func only gets the newest sample every <update_interval> (of recorded time).
+        The throughput is stored in dev.stats
+    @param dev: ReplayDevice
+    @param update_func: Callable or list of Callables that process the measurements: (index, ival, vval) -> None
+    """
+    _replay(dev, count, update_func, update_interval, verbose)
+    if beep_done: beep(dev)
+
+
+def measure(dev, interval, update_func=None, max_measurements=None):
+    """
+    Replay the recordings, the update_func gets every sample
+
+    @details
+        The timing is taken from the recording, interval is ignored.
+        The throughput is stored in dev.stats
+    @param dev: ReplayDevice
+    @param update_func: Callable or list of Callables that process the measurements: (index, ival, vval) -> None
+    @param max_measurements : maximum number of samples. None means all
+    """
+    _replay(dev, max_measurements, update_func, None, True)
+    print("Measurement stopped" + " "*50)
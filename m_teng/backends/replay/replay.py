@@ -0,0 +1,142 @@
+"""
+Replay recordings that were saved with save_csv or save_pickle as if they were measured live
+
+The device has the same buffer functions as the keithley backend, the buffers contain the samples
+that were replayed so far.
+"""
+import numpy as np
+
+from m_teng.utility.data import load_dataframe
+
+
+# wrapper for the global replay settings, used by init
+class Source:
+    def __init__(self):
+        self.paths = []
+        self.speed = 1.0
+_source = Source()
+
+
+class ReplayDevice:
+    """
+    @param data: 2D array: timestamps, current, voltage
+    @param speed: replay speed relative to the recording, 0 means as fast as possible
+    """
+    def __init__(self, data, speed=1.0, paths=None):
+        self.data = data
+        self.speed = speed
+        self.paths = paths if paths else []
+        self.n = 0  # number of replayed samples
+        self.stats = None  # throughput of the last replay, see measure.py
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        speed = f"{self.speed}x" if self.speed > 0 else "max"
+        return f"ReplayDevice({len(self.paths)} recordings, {len(self.data)} samples, speed={speed})"
+
+
+def set_source(paths):
+    """
+    Set the recordings that are replayed by the next device returned by init
+    @param paths: path or list of paths of csv or pkl files
+    """
+    if type(paths) == str: paths = [paths]
+    _source.paths = list(paths)
+
+
+def set_speed(dev, speed):
+    """
+    @param dev: ReplayDevice or None to only set the speed for init
+    @param speed: 1 means real-time, 10 ten times faster than recorded, 0 as fast as possible
+    """
+    if speed < 0: raise ValueError(f"Invalid speed: {speed}, must be >= 0")
+    _source.speed = speed
+    if dev is not None: dev.speed = speed
+
+
+def load_recordings(paths):
+    """
+    Load and concatenate recordings. The timestamps of each recording continue after the previous one.
+    @returns: 2D array: timestamps, current, voltage
+    """
+    parts = []
+    t_end = 0.0
+    for p in paths:
+        df = load_dataframe(p)
+        if df is None: continue
+        data = df.to_numpy(dtype=np.float64)[:, :3].copy()
+        if len(data) == 0: continue
+        # rows of lost samples in sequenced arduino recordings are NaN
+        finite = np.flatnonzero(np.isfinite(data[:,0]))
+        if len(finite) == 0: continue
+        dt = np.nanmedian(np.diff(data[:,0])) if len(finite) > 1 else 0.0
+        if np.isnan(dt): dt = 0.0
+        data[:,0] += t_end - data[finite[0],0]
+        t_end = data[finite[-1],0] + dt
+        parts.append(data)
+    if not parts:
+        raise Exception(f"No recordings to replay in {paths}")
+    return np.vstack(parts)
+
+
+def get_sample_interval(dev):
+    """
+    @returns: median time between two recorded samples in seconds, 0 for less than two samples
+    """
+    if len(dev.data) < 2: return 0.0
+    return float(np.nanmedian(np.diff(dev.data[:,0])))
+
+
+def init(beep_success=True, paths=None, speed=None):
+    """
+    Load the recordings
+    @param paths: recordings to replay, None means the ones from set_source
+    @param speed: replay speed, None means the one from set_speed
+    @returns: ReplayDevice
+    """
+    if paths is None: paths = _source.paths
+    if speed is None: speed = _source.speed
+    dev = ReplayDevice(load_recordings(paths), speed=speed, paths=paths)
+    print(f"Loaded {dev}")
+    if beep_success: beep(dev)
+    return dev
+
+
+def exit(dev):
+    pass
+
+
+def reset(dev):
+    """
+    Clear the buffers
+    """
+    dev.n = 0
+
+
+def get_buffer_size(dev, buffer_nr=1):
+    return dev.n
+
+
+def collect_buffer(dev, buffer_nr=1):
+    """
+    @param buffer_nr: 1 -> current, 2 -> voltage
+    @returns 2D numpy array: timestamps, readings of the replayed samples
+    """
+    assert(buffer_nr in (1, 2))
+    return np.vstack((dev.data[:dev.n,0], dev.data[:dev.n,buffer_nr])).T
+
+
+def collect_buffer_range(dev, range_=(1, -1), buffer_nr=1):
+    """
+    Like collect_buffer, for the 1-based inclusive range_ like in the keithley backend
+    """
+    assert(buffer_nr in (1, 2))
+    end = dev.n if range_[1] == -1 else min(range_[1], dev.n)
+    start = max(range_[0] - 1, 0)
+    return np.vstack((dev.data[start:end,0], dev.data[start:end,buffer_nr])).T
+
+
+def beep(dev):
+    print("beep")
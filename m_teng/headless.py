@@ -0,0 +1,162 @@
+"""
+Run measurements from a job file, without plotting or printing every sample
+
+The job file is a json file. Its top level keys are the defaults for all jobs, the optional key "jobs"
+holds a list of jobs that override these defaults. Without "jobs", the top level is the only job.
+Example:
+{
+    "backend": "keithley",
+    "datadir": "~/data/session1",
+    "interval": 0.02,
+    "count": 6000,
+    "jobs": [
+        { "name": "baseline", "repeat": 5 },
+        { "name": "shaker_10Hz", "repeat": 10, "repeat_delay": 2, "format": "pkl" }
+    ]
+}
+"""
+import json
+import importlib
+from os import path, makedirs
+from time import sleep
+
+from m_teng.utility import data as _data
+from m_teng.utility import file_io
+
+BACKENDS = ["keithley", "arduino"]
+
+# keys that every job must have, at the top level or in the job
+REQUIRED_KEYS = ["backend"]
+
+JOB_DEFAULTS = {
+    "datadir":      "~/data",
+    "name":         "measurement",
+    "interval":     0.02,
+    "count":        5000,
+    "repeat":       1,
+    "repeat_delay": 0,
+    "format":       "csv",
+    "profile":      None,
+    "absolute_time": False,
+}
+
+
+def load_backend(name: str):
+    """
+    Import a backend
+    @param name: name of the backend, the name of a directory in m_teng/backends
+    @returns: (backend module, measure module)
+    """
+    backend = importlib.import_module(f"m_teng.backends.{name}.{name}")
+    measure = importlib.import_module(f"m_teng.backends.{name}.measure")
+    return backend, measure
+
+
+def load_jobs(jobfile: str):
+    """
+    Load and validate the jobs from a job file
+    @returns: non-empty list of jobs, each job is a dict with the keys from REQUIRED_KEYS and JOB_DEFAULTS
+    """
+    with open(jobfile, "r") as file:
+        content = json.load(file)
+    if type(content) != dict:
+        raise ValueError("The job file must contain a json object")
+    job_list = content.get("jobs", [{}])
+    if type(job_list) != list or len(job_list) == 0:
+        raise ValueError("'jobs' must be a non-empty list")
+    defaults = JOB_DEFAULTS.copy()
+    defaults.update({ k: v for k, v in content.items() if k != "jobs" })
+    jobs = []
+    for n, job_overrides in enumerate(job_list):
+        if type(job_overrides) != dict:
+            raise ValueError(f"Job {n} must be a json object")
+        job = defaults.copy()
+        job.update(job_overrides)
+        missing = [ k for k in REQUIRED_KEYS if k not in job ]
+        if missing:
+            raise ValueError(f"Missing keys in job '{job['name']}': {missing}")
+        unknown = set(job.keys()) - set(JOB_DEFAULTS.keys()) - set(REQUIRED_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown keys in job '{job['name']}': {unknown}")
+        if job["backend"] not in BACKENDS:
+            raise ValueError(f"Invalid backend in job '{job['name']}': '{job['backend']}', must be one of {BACKENDS}")
+        if jobs and job["backend"] != jobs[0]["backend"]:
+            raise ValueError(f"All jobs must use the same backend, job '{job['name']}' uses '{job['backend']}' instead of '{jobs[0]['backend']}'")
+        if job["format"] not in ["csv", "pkl"]:
+            raise ValueError(f"Invalid format in job '{job['name']}': '{job['format']}', must be 'csv' or 'pkl'")
+        for key in ["count", "repeat"]:
+            if type(job[key]) != int or job[key] < 1:
+                raise ValueError(f"Invalid {key} in job '{job['name']}': {job[key]}, must be a positive integer")
+        if type(job["interval"]) not in [int, float] or job["interval"] <= 0:
+            raise ValueError(f"Invalid interval in job '{job['name']}': {job['interval']}, must be a number > 0")
+        if type(job["repeat_delay"]) not in [int, float] or job["repeat_delay"] < 0:
+            raise ValueError(f"Invalid repeat_delay in job '{job['name']}': {job['repeat_delay']}, must be a number >= 0")
+        job["datadir"] = path.expanduser(job["datadir"])
+        jobs.append(job)
+    return jobs
+
+
+def save(dev, backend, job):
+    """
+    Save the device buffers as the next file in the jobs datadir
+    @returns: filepath
+    """
+    ibuffer = backend.collect_buffer(dev, 1)
+    vbuffer = backend.collect_buffer(dev, 2)
+    df = _data.buffers2dataframe(ibuffer, vbuffer)
+    if job["absolute_time"] and hasattr(backend, "get_clock_sync") and backend.get_clock_sync(dev) is not None:
+        _data.add_absolute_time(df, backend.get_clock_sync(dev))
+    basename = file_io.get_next_filename(job["name"], job["datadir"])
+    filepath = job["datadir"] + "/" + basename + "." + job["format"]
+    if job["format"] == "csv":
+        _data.write_csv(df, filepath)
+    else:
+        df.to_pickle(filepath)
+    return filepath
+
+
+def run_job(dev, backend, measure, job):
+    """
+    Run all repetitions of a job
+    """
+    if not path.isdir(job["datadir"]):
+        makedirs(job["datadir"])
+    if hasattr(backend, "set_profile"):
+        backend.set_profile(job["profile"])
+    for n in range(job["repeat"]):
+        measure.measure_count(dev, count=job["count"], interval=job["interval"], update_func=None, beep_done=False, verbose=False)
+        filepath = save(dev, backend, job)
+        print(f"{job['name']} ({n+1}/{job['repeat']}): saved as '{filepath}'")
+        if n + 1 < job["repeat"]:
+            sleep(job["repeat_delay"])
+
+
+def run_jobfile(jobfile: str) -> int:
+    """
+    Run all jobs in a job file
+    @returns: exit status: 0 on success, 1 if the jobfile is invalid or the device could not be opened, 2 if a job failed
+    """
+    try:
+        jobs = load_jobs(jobfile)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: run_jobfile: Invalid job file '{jobfile}': {e}")
+        return 1
+    try:
+        backend, measure = load_backend(jobs[0]["backend"])
+        dev = backend.init(beep_success=False)
+    except Exception as e:
+        print(f"ERROR: run_jobfile: Could not open device: {e}")
+        return 1
+    status = 0
+    try:
+        for job in jobs:
+            run_job(dev, backend, measure, job)
+    except KeyboardInterrupt:
+        print("Cancelled")
+        status = 2
+    except Exception as e:
+        print(f"ERROR: run_jobfile: Job '{job['name']}' failed: {e}")
+        status = 2
+    finally:
+        backend.exit(dev)
+    return status
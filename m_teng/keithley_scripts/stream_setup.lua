@@ -0,0 +1,25 @@
+-- continuous measurement with the trigger model
+-- both buffers are used as ring buffers, the host has to drain them while measuring
+smua.nvbuffer1.clear()
+smua.nvbuffer1.fillmode = smua.FILL_WINDOW
+smua.nvbuffer1.appendmode = 1
+smua.nvbuffer1.collecttimestamps = 1
+
+smua.nvbuffer2.clear()
+smua.nvbuffer2.fillmode = smua.FILL_WINDOW
+smua.nvbuffer2.appendmode = 1
+smua.nvbuffer2.collecttimestamps = 1
+
+-- timer 1 triggers a measurement every trigger.timer[1].delay seconds, the host sets the delay
+-- count = 0 means infinite
+trigger.timer[1].count = 0
+trigger.timer[1].passthrough = true
+trigger.timer[1].stimulus = smua.trigger.ARMED_EVENT_ID
+
+smua.trigger.arm.count = 1
+smua.trigger.count = 0
+smua.trigger.source.action = smua.DISABLE
+smua.trigger.measure.action = smua.ENABLE
+smua.trigger.measure.stimulus = trigger.timer[1].EVENT_ID
+smua.trigger.measure.iv(smua.nvbuffer1, smua.nvbuffer2)
+smua.trigger.endpulse.action = smua.SOURCE_HOLD
@@ -14,6 +14,7 @@ import pandas as pd
 from datetime import datetime as dtime
 from sys import exit
 from time import sleep
+from functools import partial
 from os import path, makedirs
 import pickle as pkl
 import json
@@ -22,49 +23,65 @@ import atexit
 import argparse
 
 
-if __name__ == "__main__":
-    import sys
-    if __package__ is None:
-        # make relative imports work as described here: https://peps.python.org/pep-0366/#proposed-change
-        __package__ = "m_teng"
-        from os import path
-        filepath = path.realpath(path.abspath(__file__))
-        sys.path.insert(0, path.dirname(path.dirname(filepath)))
+def _get_argparser():
     parser = argparse.ArgumentParser(
         prog="m-teng",
         description="measure triboelectric nanogenerator output using a Keithley SMU or an Arduino",
     )
-    backend_group = parser.add_mutually_exclusive_group(required=True)
+    backend_group = parser.add_mutually_exclusive_group(required=False)
     backend_group.add_argument("-k", "--keithley", action="store_true")
     backend_group.add_argument("-a", "--arduino", action="store_true")
     backend_group.add_argument("-t", "--testing", action='store_true')
+    backend_group.add_argument("-r", "--replay", action="store", nargs="+", metavar="FILE", help="replay recordings instead of measuring")
     parser.add_argument("-c", "--config", action="store", help="alternate path to config file")
+    parser.add_argument("-j", "--job", action="store", help="run the measurements in a job file without the interactive shell and exit")
+    return parser
+
+
+def _parse_args():
+    """
+    Parse the command line arguments and import the selected backend
+    """
+    global args, _backend, _measure
+    parser = _get_argparser()
     args = vars(parser.parse_args())
+    if args["job"]: return
+    if args["keithley"]:
+        import m_teng.backends.keithley.keithley as _backend
+        import m_teng.backends.keithley.measure as _measure
+    elif args["arduino"]:
+        import m_teng.backends.arduino.arduino as _backend
+        import m_teng.backends.arduino.measure as _measure
+    elif args["replay"]:
+        import m_teng.backends.replay.replay as _backend
+        import m_teng.backends.replay.measure as _measure
+        _backend.set_source(args["replay"])
+    elif args["testing"]:
+        import m_teng.backends.testing.testing as _backend
+        import m_teng.backends.testing.measure as _measure
+    else:
+        parser.error("one of the arguments -k/--keithley -a/--arduino -t/--testing -r/--replay -j/--job is required")
 
-    i = 1
-    while i < len(sys.argv):
-        if args["keithley"]:
-            import m_teng.backends.keithley.keithley as _backend
-            import m_teng.backends.keithley.measure as _measure
-        elif args["arduino"]:
-            import m_teng.backends.arduino.arduino as _backend
-            import m_teng.backends.arduino.measure as _measure
-        elif args["testing"]:
-            import m_teng.backends.testing.testing as _backend
-            import m_teng.backends.testing.measure as _measure
-        elif sys.argv[i] in ["-c", "--config"]:
-            if i+1 < len(sys.argv):
-                config_path = sys.argv[i+1]
-            else:
-                print("-c requires an extra argument: path of config file")
-            i += 1
-        i += 1
+
+if __name__ == "__main__":
+    import sys
+    if __package__ is None:
+        # make relative imports work as described here: https://peps.python.org/pep-0366/#proposed-change
+        __package__ = "m_teng"
+        from os import path
+        filepath = path.realpath(path.abspath(__file__))
+        sys.path.insert(0, path.dirname(path.dirname(filepath)))
+    _parse_args()
 
 
 from m_teng.utility import data as _data
-from m_teng.utility.data import load_dataframe
+from m_teng.utility.data import load_dataframe, load_many
 from m_teng.utility import file_io
 from m_teng.update_funcs import _Monitor, _ModelPredict, _update_print
+from m_teng.utility.sample_bus import SampleBus, CsvWriter, Printer
+from m_teng.utility import tracing
+from m_teng.utility import trigger as _trigger
+from m_teng.utility.preview import render_previews
 
 config_path = path.expanduser("~/.config/m-teng.json")
 
@@ -77,6 +94,9 @@ settings = {
     "name":         "measurement",
     "interval":     0.02,
     "beep":         True,
+    # "precise" needs an interval of at least 0.05s
+    "profile":      "balanced",
+    "absolute_time": False,
 }
 
 test = False
@@ -85,32 +105,94 @@ test = False
 dev = None
 
 
-def monitor_predict(model_dir: str, count=5000, interval=None, max_points_shown=160):
+def _check_interval(interval):
     """
-    Take <count> measurements in <interval> and predict with a machine learning model
+    Warn if the interval is shorter than what the speed profile can deliver
     """
-    if not interval: interval = settings["interval"]
+    if not hasattr(_backend, "get_min_interval"): return
+    min_interval = _backend.get_min_interval(settings["profile"])
+    if interval < min_interval:
+        print(f"WARNING: interval={interval}s is shorter than the {min_interval}s the speed profile '{settings['profile']}' can deliver. Use a faster profile or run probe_profiles()")
 
-    model_predict = _ModelPredict(dev, model_dir)
-    plt_monitor = _Monitor(max_points_shown, use_print=False)
-    skip_n = 0
-    def update(i, ival, vval):
-        plt_monitor.update(i, ival, vval)
-        if skip_n % 10 == 0:
-            model_predict.update(i, ival, vval)
-        skip_n += 1
 
-    print(f"Starting measurement with:\n\tinterval = {interval}s\nSave the data using 'save_csv()' afterwards.")
+def probe_profiles(count=200):
+    """
+    Measure the shortest achievable interval for each speed profile (keithley only)
+    The results are used for warning about too short intervals.
+    """
+    if not hasattr(_backend, "probe_profiles"):
+        print("probe_profiles: Only available with the keithley backend")
+        return
+    return _backend.probe_profiles(dev, count=count)
+
+
+def monitor_predict(model_dir, count=5000, interval=None, max_points_shown=160, optimize=True, quantize=False, log_path=None):
+    """
+    Take <count> measurements in <interval> and predict with one or more machine learning models
+    @param model_dir: model directory or list of model directories. All models predict on the same data
+    @param optimize: use the model exported to TorchScript, which is cached after the first use
+    @param quantize: use dynamic int8 quantization, only with optimize=True
+    @param log_path: append all predictions with their time to this csv file
+    """
+    if not interval: interval = settings["interval"]
+    _check_interval(interval)
+
+    model_predict = _ModelPredict(dev, model_dir, optimize=optimize, quantize=quantize, backend=_backend, log_path=log_path)
     try:
-        _measure.measure_count(dev, count=count, interval=interval, beep_done=False, verbose=False, update_func=update, update_interval=0.1)
-    except KeyboardInterrupt:
-        if args["keithley"]:
-            dev.write(f"smua.source.output = smua.OUTPUT_OFF")
-        print("Monitoring cancelled, measurement might still continue" + " "*50)
-    else:
-        print("Measurement finished" + " "*50)
+        plt_monitor = _Monitor(max_points_shown, use_print=False)
+        skip_n = 0
+        def update(i, ival, vval):
+            nonlocal skip_n
+            plt_monitor.update(i, ival, vval)
+            if skip_n % 10 == 0:
+                with tracing.span("predict", "predict"):
+                    model_predict.update(i, ival, vval)
+            skip_n += 1
+
+        print(f"Starting measurement with:\n\tinterval = {interval}s\nSave the data using 'save_csv()' afterwards.")
+        try:
+            _measure.measure_count(dev, count=count, interval=interval, beep_done=False, verbose=False, update_func=update, update_interval=0.1)
+        except KeyboardInterrupt:
+            if args["keithley"]:
+                dev.write(f"smua.source.output = smua.OUTPUT_OFF")
+            print("Monitoring cancelled, measurement might still continue" + " "*50)
+        else:
+            print("Measurement finished" + " "*50)
+    finally:
+        # also on errors of the backend, the models or the plot, so that the threads and the log file are closed
+        model_predict.close()
+
+def _start_detached(monitor_kwargs=None, use_print=False, log_path=None):
+    """
+    Run the consumers of the measurement in separate processes that read from a SampleBus
+    @param monitor_kwargs: arguments for the matplotlib monitor. None means no monitor
+    @param use_print: print the newest sample
+    @param log_path: write every sample to this csv file
+    @returns: SampleBus, its update method is the update_func for the measurement
+    """
+    bus = SampleBus()
+    if monitor_kwargs is not None:
+        bus.start_consumer(partial(_Monitor, **monitor_kwargs))
+    if use_print:
+        bus.start_consumer(Printer)
+    if log_path is not None:
+        bus.start_consumer(partial(CsvWriter, log_path))
+    return bus
+
 
-def monitor_count(count=5000, interval=None, max_points_shown=160):
+def _buffer_spectrum_source(n=256):
+    """
+    @returns: spectrum_source for _Monitor that reads the newest n voltage values from the device buffer
+    """
+    def source():
+        size = _backend.get_buffer_size(dev, buffer_nr=2)
+        if size < 16: return None
+        vbuffer = _backend.collect_buffer_range(dev, (max(size - n + 1, 1), size), buffer_nr=2)
+        return vbuffer[:,1], float(np.median(np.diff(vbuffer[:,0])))
+    return source
+
+
+def monitor_count(count=5000, interval=None, max_points_shown=160, detached=False, spectrum=False):
     """
     Take <count> measurements in <interval> and monitor live with matplotlib.
 
@@ -122,10 +204,22 @@ def monitor_count(count=5000, interval=None, max_points_shown=160):
     @param count: count
     @param interval: interval, defaults to settings["interval"]
     @param max_points_shown: how many points should be shown at once. None means infinite
+    @param detached: plot in a separate process, so that drawing does not delay the measurement
+    @param spectrum: show the spectrum of the newest voltage values. They are read from the device buffer,
+        since the monitor only gets the newest value every update interval. Not available with detached=True
     """
     if not interval: interval = settings["interval"]
-    plt_monitor = _Monitor(max_points_shown, use_print=True)
-    update_func = plt_monitor.update
+    _check_interval(interval)
+    if spectrum and (detached or not hasattr(_backend, "collect_buffer_range")):
+        print("monitor_count: spectrum requires detached=False and a backend with collect_buffer_range (keithley, replay)")
+        return
+    if detached:
+        bus = _start_detached(monitor_kwargs={ "max_points_shown": max_points_shown, "use_print": True })
+        update_func = bus.update
+    else:
+        source = _buffer_spectrum_source() if spectrum else None
+        plt_monitor = _Monitor(max_points_shown, use_print=True, spectrum=spectrum, spectrum_source=source)
+        update_func = plt_monitor.update
 
     print(f"Starting measurement with:\n\tinterval = {interval}s\nSave the data using 'save_csv()' afterwards.")
     try:
@@ -136,8 +230,10 @@ def monitor_count(count=5000, interval=None, max_points_shown=160):
         print("Monitoring cancelled, measurement might still continue" + " "*50)
     else:
         print("Measurement finished" + " "*50)
+    finally:
+        if detached: bus.close()
 
-def measure_count(count=5000, interval=None):
+def measure_count(count=5000, interval=None, detached=False, log_path=None):
     """
     Take <count> measurements in <interval>
 
@@ -148,9 +244,17 @@ def measure_count(count=5000, interval=None):
         You can take the data from the buffer afterwards, using save_csv
     @param count: count
     @param interval: interval, defaults to settings["interval"]
+    @param detached: print in a separate process
+    @param log_path: write the samples that are polled while measuring to this csv file, in a separate process
     """
     if not interval: interval = settings["interval"]
-    update_func = _update_print
+    _check_interval(interval)
+    bus = None
+    if detached or log_path is not None:
+        bus = _start_detached(use_print=True, log_path=log_path)
+        update_func = bus.update
+    else:
+        update_func = _update_print
 
     print(f"Starting measurement with:\n\tinterval = {interval}s\nSave the data using 'save_csv()' afterwards.")
     try:
@@ -161,11 +265,38 @@ def measure_count(count=5000, interval=None):
         print("Monitoring cancelled, measurement might still continue" + " "*50)
     else:
         print("Measurement finished" + " "*50)
+    finally:
+        if bus is not None: bus.close()
 
 
 
 
-def monitor(interval=None, max_measurements=None, max_points_shown=160):
+def measure_stream(interval=None, max_measurements=None, drain_interval=0.5):
+    """
+    Measure continuously and stream the readings to a csv file (keithley only)
+
+    @details:
+        - Uses the device internal trigger model, which allows for the same precision as measure_count
+        - The buffers are transferred to the host while measuring, so there is no limit on the number of measurements
+        - Stops after max_measurements or on <C-c>
+        The file is named like the files from save_csv.
+    @param max_measurements : maximum number of measurements. None means infinite
+    @param drain_interval: interval at which the device buffers are transferred
+    """
+    global _runtime_vars
+    if not args["keithley"]:
+        print("measure_stream: Only available with the keithley backend")
+        return
+    if not interval: interval = settings["interval"]
+    _check_interval(interval)
+    _runtime_vars["last_measurement"] = dtime.now().isoformat()
+    filename = settings["datadir"] + "/" + file_io.get_next_filename(settings["name"], settings["datadir"]) + ".csv"
+    print(f"Starting measurement with:\n\tinterval = {interval}s\nUse <C-c> to stop. Writing to '{filename}'.")
+    _measure.measure_stream(dev, interval=interval, max_measurements=max_measurements, update_func=_update_print, drain_interval=drain_interval, filepath=filename, verbose=False)
+    print(f"Saved as '{filename}'")
+
+
+def monitor(interval=None, max_measurements=None, max_points_shown=160, detached=False, spectrum=False):
     """
     Monitor the voltage with matplotlib.
 
@@ -177,17 +308,32 @@ def monitor(interval=None, max_measurements=None, max_points_shown=160):
         You can take the data from the buffer afterwards, using save_csv.
     @param max_points_shown : how many points should be shown at once. None means infinite
     @param max_measurements : maximum number of measurements. None means infinite
+    @param detached: plot in a separate process, so that drawing does not delay the measurement
+    @param spectrum: show the spectrum of the newest voltage values
     """
     global _runtime_vars
     _runtime_vars["last_measurement"] = dtime.now().isoformat()
     if not interval: interval = settings["interval"]
+    _check_interval(interval)
     print(f"Starting measurement with:\n\tinterval = {interval}s\nUse <C-c> to stop. Save the data using 'save_csv()' afterwards.")
-    plt_monitor = _Monitor(use_print=True, max_points_shown=max_points_shown)
-    update_func = plt_monitor.update
-    _measure.measure(dev, interval=interval, max_measurements=max_measurements, update_func=update_func)
+    # the arduino sends samples at a fixed interval and the replay gets every recorded sample.
+    # The other backends sleep interval after each query and update, so the monitor estimates the time between the samples
+    spectrum_dt = None
+    if args["arduino"]: spectrum_dt = interval
+    elif args["replay"]: spectrum_dt = _backend.get_sample_interval(dev)
+    if detached:
+        bus = _start_detached(monitor_kwargs={ "max_points_shown": max_points_shown, "use_print": True, "spectrum": spectrum, "spectrum_dt": spectrum_dt })
+        update_func = bus.update
+    else:
+        plt_monitor = _Monitor(use_print=True, max_points_shown=max_points_shown, spectrum=spectrum, spectrum_dt=spectrum_dt)
+        update_func = plt_monitor.update
+    try:
+        _measure.measure(dev, interval=interval, max_measurements=max_measurements, update_func=update_func)
+    finally:
+        if detached: bus.close()
 
 
-def measure(interval=None, max_measurements=None):
+def measure(interval=None, max_measurements=None, detached=False, log_path=None):
     """
     Measure voltages
 
@@ -198,13 +344,65 @@ def measure(interval=None, max_measurements=None):
         Uses python's time.sleep() for waiting the interval, which is not very precise. Use measure_count for better precision.
         You can take the data from the buffer afterwards, using save_csv.
     @param max_measurements : maximum number of measurements. None means infinite
+    @param detached: print in a separate process
+    @param log_path: write every sample to this csv file while measuring, in a separate process
     """
     global _runtime_vars
     if not interval: interval = settings["interval"]
+    _check_interval(interval)
     _runtime_vars["last_measurement"] = dtime.now().isoformat()
     print(f"Starting measurement with:\n\tinterval = {interval}s\nUse <C-c> to stop. Save the data using 'save_csv()' afterwards.")
-    update_func = _update_print
-    _measure.measure(dev, interval=interval, max_measurements=max_measurements, update_func=update_func)
+    bus = None
+    if detached or log_path is not None:
+        bus = _start_detached(use_print=True, log_path=log_path)
+        update_func = bus.update
+    else:
+        update_func = _update_print
+    try:
+        _measure.measure(dev, interval=interval, max_measurements=max_measurements, update_func=update_func)
+    finally:
+        if bus is not None: bus.close()
+
+
+def capture(channel="V", mode="threshold", level=1.0, direction="rising", pre=100, post=400, count=None, interval=None):
+    """
+    Measure and save only the segments around trigger events
+
+    @details:
+        Each segment is saved as 'datadir/nameXXX.csv'. The absolute time of each trigger is listed in 'datadir/name_triggers.csv'.
+        Without count, measures like measure() until <C-c> and checks the trigger with every measurement.
+        With count, measures like measure_count() and searches the triggers in the whole buffer afterwards.
+    @param channel: "V" for voltage or "I" for current
+    @param mode: "threshold": trigger when the value crosses level, "slope": trigger when the difference between two consecutive values exceeds level
+    @param level: threshold in V or A, or slope in V or A per measurement
+    @param direction: "rising", "falling" or "both"
+    @param pre: number of measurements to keep before the trigger
+    @param post: number of measurements to keep after the trigger, including the trigger
+    """
+    global _runtime_vars
+    if not interval: interval = settings["interval"]
+    _check_interval(interval)
+    trig = _trigger.Trigger(channel=channel, mode=mode, level=level, direction=direction)
+    _runtime_vars["last_measurement"] = dtime.now().isoformat()
+    if count is None:
+        print(f"Starting triggered capture with:\n\tinterval = {interval}s\nUse <C-c> to stop.")
+        triggered = _trigger.TriggeredCapture(trig, pre=pre, post=post)
+        _measure.measure(dev, interval=interval, update_func=triggered.update)
+        segments = triggered.flush()
+    else:
+        print(f"Starting measurement with:\n\tinterval = {interval}s\nThe triggers are searched when the measurement is finished.")
+        t_start = dtime.now().timestamp()
+        try:
+            _measure.measure_count(dev, count=count, interval=interval, beep_done=False, verbose=False, update_func=_update_print, update_interval=0.05)
+        except KeyboardInterrupt:
+            if args["keithley"]:
+                dev.write(f"smua.source.output = smua.OUTPUT_OFF")
+            print("Measurement cancelled" + " "*50)
+            return
+        data = get_dataframe().to_numpy()
+        segments = _trigger.find_segments(data, trig, pre=pre, post=post, t_start=t_start)
+    filepaths = _trigger.save_segments(segments, settings["datadir"], settings["name"])
+    print(f"Saved {len(filepaths)} triggered segments in '{settings['datadir']}'" + " "*30)
 
 
 def repeat(measure_func: callable, count: int, repeat_delay=0):
@@ -241,6 +439,12 @@ def get_dataframe():
     ibuffer = _backend.collect_buffer(dev, 1)
     vbuffer = _backend.collect_buffer(dev, 2)
     df = _data.buffers2dataframe(ibuffer, vbuffer)
+    if settings["absolute_time"]:
+        clock_sync = _backend.get_clock_sync(dev) if hasattr(_backend, "get_clock_sync") else None
+        if clock_sync is None:
+            print("get_dataframe: No clock sync for the last measurement, not adding absolute timestamps")
+        else:
+            _data.add_absolute_time(df, clock_sync)
     df.basename = file_io.get_next_filename(settings["name"], settings["datadir"])
     df.name = f"{df.basename} @ {_runtime_vars['last-measurement']}"
     return df
@@ -252,9 +456,11 @@ def save_csv():
     The settings 'datadir' and 'name' are used for determining the filepath:
     'datadir/nameXXX.csv', where XXX is the number of files that exist in datadir with the same name.
     """
-    df = get_dataframe()
+    with tracing.span("get_dataframe", "save"):
+        df = get_dataframe()
     filename = settings["datadir"] + "/" + df.basename + ".csv"
-    df.to_csv(filename, index=False, header=True)
+    with tracing.span("write_csv", "save"):
+        _data.write_csv(df, filename)
     print(f"Saved as '{filename}'")
 
 
@@ -264,12 +470,35 @@ def save_pickle():
     The settings 'datadir' and 'name' are used for determining the filepath:
     'datadir/nameXXX.pkl', where XXX is the number of files that exist in datadir with the same name.
     """
-    df = get_dataframe()
+    with tracing.span("get_dataframe", "save"):
+        df = get_dataframe()
     filename = settings["datadir"] + "/" + df.basename + ".pkl"
-    df.to_pickle(filename)
+    with tracing.span("to_pickle", "save"):
+        df.to_pickle(filename)
     print(f"Saved as '{filename}'")
 
 
+def trace_start():
+    """
+    Start recording the time spent polling the device, in update functions, plotting, inference and saving
+    Export the timeline with trace_stop()
+    """
+    tracing.start()
+    print("Tracing started, use 'trace_stop()' to export the trace")
+
+
+def trace_stop(filepath=None):
+    """
+    Stop tracing and export the recorded timeline as Chrome trace json, which can be opened with https://ui.perfetto.dev
+    @param filepath: defaults to 'datadir/trace-<time>.json'
+    """
+    tracing.stop()
+    if filepath is None:
+        filepath = settings["datadir"] + "/trace-" + dtime.now().strftime("%Y-%m-%dT%H-%M-%S") + ".json"
+    n = tracing.export(filepath)
+    print(f"Saved {n} spans as '{filepath}'")
+
+
 def run_script(script_path):
     """
     Run a lua script on the Keithley device
@@ -288,6 +517,12 @@ def set(setting, value):
         if type(value) != type(settings[setting]):
             print(f"set: setting '{setting}' currently holds a value of type '{type(settings[setting])}'")
             return
+    if setting == "profile" and hasattr(_backend, "set_profile"):
+        try:
+            _backend.set_profile(value)
+        except ValueError as e:
+            print(f"set: {e}")
+            return
     settings[setting] = value
 
 def name(s:str):
@@ -301,7 +536,8 @@ def save_settings():
 def load_settings():
     global settings, config_path
     with open(config_path, "r") as file:
-        settings = json.load(file)
+        # keep the defaults of settings that are missing in older files
+        settings.update(json.load(file))
     settings["datadir"] = path.expanduser(settings["datadir"])  # replace ~
 
 def help(topic=None):
@@ -312,12 +548,19 @@ Functions:
     monitor         [kat] - take measurements with live monitoring in a matplotlib window
     measure_count   [kat] - take a fixed number of measurements
     monitor_count   [kat] - take a fixed number of measurements with live monitoring in a matplotlib window
+    capture         [kat] - take measurements and save only the segments around trigger events
+    measure_stream  [k  ] - take measurements and stream them to a csv file, without limit on the number of measurements
     repeat          [kat] - measure and save to csv multiple times
     get_dataframe   [kat] - return device internal buffer as pandas dataframe
     save_csv        [kat] - save the last measurement as csv file
     save_pickle     [kat] - save the last measurement as pickled pandas dataframe
     load_dataframe  [kat] - load a pandas dataframe from csv or pickle
+    load_many       [kat] - load many csv or pickle files in parallel, with caching
+    render_previews [kat] - render preview images for a directory of recordings
     run_script      [k  ] - run a lua script on the Keithely device
+    trace_start     [kat] - start recording a timeline of the session
+    trace_stop      [kat] - stop recording and export the timeline as Chrome trace
+    probe_profiles  [k  ] - measure the shortest interval of each speed profile
 Run 'help(function)' to see more information on a function
 
 Available topics:
@@ -332,6 +575,9 @@ Run 'help("topic")' to see more information on a topic""")
     datadir: str    - output directory for the csv files
     interval: int   - interval (inverse frequency) of the measurements, in seconds
     beep: bool      - wether the device should beep or not
+    profile: str    - speed profile of the Keithley SMU: "precise", "balanced" (default) or "max-rate"
+                      "max-rate" uses the fixed ranges rangev and rangei of keithley.SPEED_PROFILES, larger peaks are clipped
+    absolute_time: bool - add a column with the unix time of every sample, synchronized with the device clock
 
 Functions:
     name("<name>")         - short for set("name", "<name>")
@@ -357,7 +603,14 @@ Functions:
         You can interact using pyvisa functions, such as
         k.write("command"), k.query("command") etc. to interact with the device.
     arduino backend:
-        The Arduino will be avaiable as BleakClient using the global variable 'dev'.  """)
+        The Arduino will be avaiable as BleakClient using the global variable 'dev'.
+        Readings are converted to volts with the calibration of the device, the raw values of the last
+        measurement are in _backend._buffer.raw. Fit a new calibration with
+        _backend.set_calibration(dev, _backend.fit_calibration(raw, voltages))
+    replay backend:
+        'dev' is a ReplayDevice with the recordings given with -r. Set the speed with
+        _backend.set_speed(dev, 10), where 0 means as fast as possible.
+        After a measurement, dev.stats holds the throughput of every update_func.  """)
     else:
         print(topic.__doc__)
 
@@ -394,6 +647,9 @@ Enter 'help()' for a list of commands""")
     if not path.isdir(settings["datadir"]):
         makedirs(settings["datadir"])
 
+    if hasattr(_backend, "set_profile"):
+        _backend.set_profile(settings["profile"])
+
     try:
         dev = _backend.init(beep_success=settings["beep"])
     except Exception as e:
@@ -402,5 +658,21 @@ Enter 'help()' for a list of commands""")
     atexit.register(_backend.exit, dev)
 
 
+def main():
+    """
+    Entry point of the m-teng script
+    """
+    _parse_args()
+    if args["job"]:
+        from m_teng.headless import run_jobfile
+        exit(run_jobfile(args["job"]))
+    init()
+    import code
+    code.interact(banner="", local=globals())
+
+
 if __name__ == "__main__":
+    if args["job"]:
+        from m_teng.headless import run_jobfile
+        exit(run_jobfile(args["job"]))
     init()
@@ -1,13 +1,24 @@
 import matplotlib.pyplot as plt
 import numpy as np
+import pickle as pkl
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from time import perf_counter, time
 
-import torch
+try:
+    import torch
 
-from teng_ml.util import model_io as mio
-from teng_ml.util.settings import MLSettings
-from teng_ml.util.split import DataSplitter
+    from teng_ml.util import model_io as mio
+    from teng_ml.util.settings import MLSettings
+    from teng_ml.util.split import DataSplitter
+except ImportError:
+    # only required for _ModelPredict
+    torch = None
 
 from m_teng.backends.keithley import keithley
+from m_teng.utility import model_cache
+from m_teng.utility.data import spectrum as _spectrum
+from m_teng.utility import tracing
 
 def _update_print(i, ival, vval):
     print(f"n = {i:5d}, I = {ival: .12f} A, U = {vval: .5f} V" + " "*10, end='\r')
@@ -16,15 +27,44 @@ class _Monitor:
     """
     Monitor v and i data
     """
-    def __init__(self, max_points_shown=None, use_print=False):
+    def __init__(self, max_points_shown=None, use_print=False, spectrum=False, spectrum_n=256, spectrum_dt=None, spectrum_update_interval=0.5, spectrum_source=None):
+        """
+        @param spectrum: show the spectrum of the newest voltage values next to the plots
+        @param spectrum_n: number of values used for the spectrum
+        @param spectrum_dt: time between two values in seconds. None means estimate it from the time between the updates
+        @param spectrum_update_interval: minimum time between two spectrum calculations, in seconds
+        @param spectrum_source: Callable that returns the newest voltage values and the time between them: () -> (values, dt) or None.
+            Required when the update func does not get every sample, eg with measure_count.
+            None means use the values passed to update
+        """
         self.max_points_shown = max_points_shown
         self.use_print = use_print
         self.index = []
         self.vdata = []
         self.idata = []
 
+        self.spectrum = spectrum
+        self.spectrum_n = spectrum_n
+        self.spectrum_dt = spectrum_dt
+        self.spectrum_update_interval = spectrum_update_interval
+        self.spectrum_source = spectrum_source
+        self.t_spectrum = 0
+        self.times = []  # host time of the updates, for estimating spectrum_dt
+
         plt.ion()
-        self.fig1, (self.vax, self.iax) = plt.subplots(2, 1, figsize=(8, 5))
+        if spectrum:
+            self.fig1 = plt.figure(figsize=(13, 5))
+            grid = self.fig1.add_gridspec(2, 2, width_ratios=(3, 2))
+            self.vax = self.fig1.add_subplot(grid[0,0])
+            self.iax = self.fig1.add_subplot(grid[1,0])
+            self.sax = self.fig1.add_subplot(grid[:,1])
+            self.sline, = self.sax.plot([], [], color="b")
+            self.smarker = self.sax.axvline(0, color="r", linestyle="--")
+            self.sax.set_xlabel("Frequency [Hz]")
+            self.sax.set_ylabel("Amplitude [V]")
+            self.sax.grid(True)
+        else:
+            self.fig1, (self.vax, self.iax) = plt.subplots(2, 1, figsize=(8, 5))
 
         self.vline, = self.vax.plot(self.index, self.vdata, color="g")
         self.vax.set_ylabel("Voltage [V]")
@@ -40,6 +80,53 @@ class _Monitor:
         self.index.append(i)
         self.idata.append(ival)
         self.vdata.append(vval)
+        if self.spectrum:
+            self.times.append(perf_counter())
+        self._draw(i)
+
+    def update_many(self, data):
+        """
+        Add several samples and redraw only once
+        @param data: 2D array: index, current, voltage
+        """
+        i = int(data[-1,0])
+        if self.use_print:
+            _update_print(i, data[-1,1], data[-1,2])
+        self.index.extend(data[:,0])
+        self.idata.extend(data[:,1])
+        self.vdata.extend(data[:,2])
+        if self.spectrum:
+            # the samples arrived together, assume they are evenly spaced since the last update
+            t_now = perf_counter()
+            t_last = self.times[-1] if self.times else t_now
+            self.times.extend(np.linspace(t_last, t_now, len(data) + 1)[1:])
+        self._draw(i)
+
+    def _update_spectrum(self):
+        t_now = perf_counter()
+        if t_now - self.t_spectrum < self.spectrum_update_interval: return
+        if self.spectrum_source is not None:
+            self.t_spectrum = t_now
+            window = self.spectrum_source()
+            if window is None: return
+            values, dt = window
+        else:
+            if len(self.vdata) < 16: return
+            self.t_spectrum = t_now
+            values = self.vdata[-self.spectrum_n:]
+            dt = self.spectrum_dt
+            if dt is None:
+                dt = float(np.median(np.diff(self.times[-len(values):])))
+        if dt <= 0: return
+        freqs, amplitudes, f0, harmonics = _spectrum(values, dt)
+        self.sline.set_xdata(freqs)
+        self.sline.set_ydata(amplitudes)
+        self.smarker.set_xdata([f0, f0])
+        self.sax.set_title(f"f = {f0:.2f} Hz, harmonics: " + ", ".join(f"{a:.3g}" for a in harmonics) + " V", fontsize="medium")
+        self.sax.relim()
+        self.sax.autoscale_view()
+
+    def _draw(self, i):
         # update data
         self.iline.set_xdata(self.index)
         self.iline.set_ydata(self.idata)
@@ -53,71 +140,175 @@ class _Monitor:
             self.vax.set_xlim(i - self.max_points_shown, i)
         self.iax.autoscale_view()
         self.vax.autoscale_view()
+        if self.spectrum:
+            with tracing.span("spectrum", "monitor"):
+                self._update_spectrum()
         # update plot
-        self.fig1.canvas.draw()
-        self.fig1.canvas.flush_events()
+        with tracing.span("canvas.draw", "monitor"):
+            self.fig1.canvas.draw()
+        with tracing.span("flush_events", "monitor"):
+            self.fig1.canvas.flush_events()
 
     def __del__(self):
         plt.close(self.fig1)
 
 
+class _PredictModel:
+    """
+    One model of _ModelPredict
+    """
+    def __init__(self, model_dir, optimize=True, quantize=False):
+        self.name = path.basename(path.normpath(model_dir))
+        self.settings: MLSettings = mio.load_settings(model_dir)
+        if self.settings.num_features != 1:  # model uses only voltage
+            raise NotImplementedError(f"Cant handle models with num_features != 1 yet")
+        if type(self.settings.splitter) == DataSplitter:
+            self.data_length = self.settings.splitter.split_size
+        else:
+            self.data_length = 200
+        self.labels = self.settings.labels.get_labels()
+        self.optimize = optimize
+        if optimize:
+            # returns the probabilities, softmax is part of the exported model
+            self.model = model_cache.load_model(model_dir, self.data_length, quantize=quantize)
+        else:
+            self.model = mio.load_model(model_dir)
+            self.model.eval()
+        # models with equal keys get the same input, so the transforms only need to run once for them
+        try:
+            transforms_key = pkl.dumps(self.settings.transforms)
+        except Exception:
+            transforms_key = id(self)
+        self.preprocessing_key = (transforms_key, self.data_length, self.settings.num_features)
+
+    def predict(self, x):
+        """
+        @param x: input tensor: (batch_size=1, seq, features)
+        @returns: label probabilities as 1D array
+        """
+        with torch.inference_mode():
+            with tracing.span(f"inference {self.name}", "predict"):
+                prediction = self.model(x)  # (batch_size, label-predictions)
+            if not self.optimize:
+                prediction = torch.nn.functional.softmax(prediction, dim=1)  # TODO remove when softmax is already applied by model
+        return prediction[0].numpy()
+
+
 class _ModelPredict:
     colors = ["red", "green", "purple", "blue", "orange", "grey", "cyan"]
-    def __init__(self, instr, model_dir):
+    def __init__(self, instr, model_dir, optimize=True, quantize=False, backend=None, log_path=None):
         """
-        @param model_dir: directory where model.plk and settings.pkl are stored
+        @param model_dir: directory where model.plk and settings.pkl are stored, or a list of such directories
+        @param backend: backend module with get_buffer_size and collect_buffer_range, None means the keithley backend
+        @param optimize: use the model exported to TorchScript, which is cached after the first use. See utility.model_cache
+        @param quantize: use dynamic int8 quantization, only with optimize=True
+        @param log_path: append every prediction to this csv file
 
         Predict the values that are currently being recorded
         @details:
-            Load the model and model settings from model dir
-            Wait until the number of recoreded points is >= the size of the models DataSplitter
-            Collect the data from the keithley, apply the transforms and predict the label with the model
-            Shows the prediction with a bar plot
+            Load the models and model settings from the model dirs
+            Wait until the number of recoreded points is >= the size of the largest DataSplitter
+            Collect the data from the device once, apply the transforms once for all models with the same preprocessing
+            and evaluate the models in parallel threads
+            Shows the predictions of all models with a grouped bar plot
+            All predictions are stored with their time in self.log: (unix time, model name, label, probability)
         """
+        if torch is None:
+            raise ImportError("_ModelPredict requires torch and teng_ml")
         self.instr = instr
-        self.model = mio.load_model(model_dir)
-        self.model_settings: MLSettings = mio.load_settings(model_dir)
-        if type(self.model_settings.splitter) == DataSplitter:
-            self.data_length = self.model_settings.splitter.split_size
-        else:
-            self.data_length = 200
+        self.backend = keithley if backend is None else backend
+        model_dirs = [model_dir] if type(model_dir) == str else list(model_dir)
+        self.models = [ _PredictModel(d, optimize=optimize, quantize=quantize) for d in model_dirs ]
+        names = [ m.name for m in self.models ]
+        for n, m in enumerate(self.models):
+            if names.count(m.name) > 1: m.name += f"_{n}"
+        self.groups = {}
+        for m in self.models:
+            self.groups.setdefault(m.preprocessing_key, []).append(m)
+        self.window_length = max(m.data_length for m in self.models)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.models)) if len(self.models) > 1 else None
+
+        self.log = []
+        self.log_file = None
+        if log_path is not None:
+            new_log = not path.isfile(log_path)
+            self.log_file = open(log_path, "a")
+            if new_log: self.log_file.write("Time,Model,Label,Probability\n")
 
         plt.ion()
         self.fig1, (self.ax) = plt.subplots(1, 1, figsize=(8, 5))
 
-        self.bar_cont = self.ax.bar(self.model_settings.labels.get_labels(), [ 1 for _ in range(len(self.model_settings.labels))])
+        labels = []
+        for m in self.models:
+            labels += [ l for l in m.labels if l not in labels ]
+        x = { l: k for k, l in enumerate(labels) }
+        width = 0.8 / len(self.models)
+        self.bars = []
+        for n, m in enumerate(self.models):
+            positions = [ x[l] - 0.4 + (n + 0.5) * width for l in m.labels ]
+            if len(self.models) == 1:
+                color = _ModelPredict.colors[:len(m.labels)]
+            else:
+                color = _ModelPredict.colors[n % len(_ModelPredict.colors)]
+            self.bars.append(self.ax.bar(positions, [ 1 for _ in m.labels ], width=width, color=color, label=m.name))
+        self.ax.set_xticks(range(len(labels)), labels)
+        self.ax.set_ylim(0, 1)
         self.ax.set_ylabel("Prediction")
         self.ax.grid(True)
+        if len(self.models) > 1: self.ax.legend()
+
+    def _predict_all(self, window):
+        """
+        @param window: 2D array: timestamps, current, voltage
+        @returns: list of (model, probabilities)
+        """
+        inputs = []
+        for models in self.groups.values():
+            data = window[-models[0].data_length:]
+            with tracing.span("transforms", "predict"):
+                for t in models[0].settings.transforms:
+                    data = t(data)
+            data = np.reshape(data[:,2], (1, -1, 1))  # batch_size, seq, features
+            x = torch.from_numpy(data.astype(np.float32))   # select voltage data, without timestamps
+            inputs += [ (m, x) for m in models ]
+        if self.executor is None:
+            return [ (m, m.predict(x)) for m, x in inputs ]
+        return list(zip([ m for m, _ in inputs ], self.executor.map(lambda mx: mx[0].predict(mx[1]), inputs)))
 
     def update(self, i, ival, vval):
-        buffer_size = keithley.get_buffer_size(self.instr, buffer_nr=1)
-        if buffer_size <= self.data_length:
-            print(f"ModelPredict.update: buffer_size={buffer_size} < {self.data_length}")
+        buffer_size = self.backend.get_buffer_size(self.instr, buffer_nr=1)
+        if buffer_size < self.window_length:
+            print(f"ModelPredict.update: buffer_size={buffer_size} < {self.window_length}")
             return
         else:
-            ibuffer = keithley.collect_buffer_range(self.instr, (buffer_size-self.data_length, buffer_size), buffer_nr=1)
-            vbuffer = keithley.collect_buffer_range(self.instr, (buffer_size-self.data_length, buffer_size), buffer_nr=2)
-        if self.model_settings.num_features == 1:  # model uses only voltage
-            data = np.vstack((ibuffer[:,0], ibuffer[:,1], vbuffer[:,1])).T
-            # print(f"data.shape:", data.shape)
-        else:
-            raise NotImplementedError(f"Cant handle models with num_features != 1 yet")
-        for t in self.model_settings.transforms:
-            data = t(data)
-        data = np.reshape(data[:,2], (1, -1, 1))  # batch_size, seq, features
-        with torch.no_grad():
-            x = torch.FloatTensor(data)   # select voltage data, without timestamps
-            # print(x.shape)
-
-            prediction = self.model(x)  # (batch_size, label-predictions)
-            prediction = torch.nn.functional.softmax(prediction)  # TODO remove when softmax is already applied by model
-            predicted = torch.argmax(prediction, dim=1, keepdim=False)  # -> [ label_indices ]
-            # print(f"raw={prediction[0]}, predicted_index={predicted[0}")
-            label = self.model_settings.labels[predicted[0]]
-            # print(f"-> label={label}")
-
-        self.bar_cont.remove()
-        self.bar_cont = self.ax.bar(self.model_settings.labels.get_labels(), prediction[0], color=_ModelPredict.colors[:len(self.model_settings.labels)])
+            # the range is inclusive, so the window has exactly window_length samples
+            range_ = (buffer_size - self.window_length + 1, buffer_size)
+            ibuffer = self.backend.collect_buffer_range(self.instr, range_, buffer_nr=1)
+            vbuffer = self.backend.collect_buffer_range(self.instr, range_, buffer_nr=2)
+        window = np.vstack((ibuffer[:,0], ibuffer[:,1], vbuffer[:,1])).T
+        t = time()
+        for n, (m, probabilities) in enumerate(self._predict_all(window)):
+            predicted = int(np.argmax(probabilities))
+            label = m.settings.labels[predicted]
+            self.log.append((t, m.name, label, float(probabilities[predicted])))
+            if self.log_file is not None:
+                self.log_file.write(f"{t},{m.name},{label},{probabilities[predicted]}\n")
+            for rect, p in zip(self.bars[self.models.index(m)], probabilities):
+                rect.set_height(p)
+        if self.log_file is not None: self.log_file.flush()
         # update plot
-        self.fig1.canvas.draw()
-        self.fig1.canvas.flush_events()
+        with tracing.span("canvas.draw", "predict"):
+            self.fig1.canvas.draw()
+        with tracing.span("flush_events", "predict"):
+            self.fig1.canvas.flush_events()
+
+    def close(self):
+        """
+        Close the log file and stop the threads
+        """
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
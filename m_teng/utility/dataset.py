@@ -0,0 +1,117 @@
+"""
+Consolidate many recordings into one dataset on disk, which is opened with np.memmap
+
+Layout of a dataset directory:
+    time.f32, current.f32, voltage.f32: the data of all recordings, concatenated, as raw float32
+    index.json: name, label, offset and length of every recording
+
+The data is only read from disk when it is accessed, so opening a dataset costs nothing up front.
+"""
+import json
+import re
+from os import path, makedirs
+
+import numpy as np
+
+from m_teng.utility.data import load_dataframe
+
+COLUMNS = ["time", "current", "voltage"]
+INDEX_FILE = "index.json"
+
+
+def label_from_name(name: str):
+    """
+    Get the label of a recording from its name: the basename without extension and trailing number
+    example: 'data/tapping_10Hz003.csv' -> 'tapping_10Hz'
+    """
+    basename = path.splitext(path.basename(name))[0]
+    return re.sub(r"\d+$", "", basename)
+
+
+def _load_index(dataset_dir):
+    index_path = path.join(dataset_dir, INDEX_FILE)
+    if not path.isfile(index_path):
+        return { "size": 0, "recordings": [] }
+    with open(index_path, "r") as file:
+        return json.load(file)
+
+
+def build_dataset(dataset_dir: str, recordings, label_func=label_from_name, verbose=True):
+    """
+    Add recordings to a dataset. Creates the dataset if it does not exist, otherwise the recordings are appended.
+
+    @param dataset_dir: directory of the dataset
+    @param recordings: paths of csv or pickle files, as saved by save_csv or save_pickle. Recordings that are already in the dataset are skipped
+    @param label_func: Callable that returns the label of a recording: (path) -> label
+    @returns: number of added recordings
+    """
+    if not path.isdir(dataset_dir):
+        makedirs(dataset_dir)
+    index = _load_index(dataset_dir)
+    known = { rec["name"] for rec in index["recordings"] }
+    files = [ open(path.join(dataset_dir, f"{col}.f32"), "ab") for col in COLUMNS ]
+    for file in files:
+        # drop data of a previous build that was interrupted before the index was written
+        file.truncate(4 * index["size"])
+    n_added = 0
+    try:
+        for p in recordings:
+            name = path.abspath(p)
+            if name in known: continue
+            df = load_dataframe(p)
+            if df is None: continue
+            data = df.to_numpy(dtype=np.float32)
+            for j, file in enumerate(files):
+                file.write(np.ascontiguousarray(data[:,j]).tobytes())
+            index["recordings"].append({ "name": name, "label": label_func(p), "offset": index["size"], "length": len(data) })
+            index["size"] += len(data)
+            known.add(name)
+            n_added += 1
+    finally:
+        for file in files:
+            file.close()
+        # the index is written last, so that an interrupted build never points to missing data
+        with open(path.join(dataset_dir, INDEX_FILE), "w") as file:
+            json.dump(index, file, indent=1)
+    if verbose: print(f"Added {n_added} recordings to '{dataset_dir}', total: {len(index['recordings'])} recordings, {index['size']} samples")
+    return n_added
+
+
+class Dataset:
+    """
+    Read only view of a dataset created with build_dataset
+
+    @details
+        dataset[i] returns the ith recording as 2D float32 array (time, current, voltage) and its label.
+        Use get_column for a single column, which does not copy.
+    """
+    def __init__(self, dataset_dir: str):
+        self.dataset_dir = dataset_dir
+        self.index = _load_index(dataset_dir)
+        self.recordings = self.index["recordings"]
+        self.labels = sorted({ rec["label"] for rec in self.recordings })
+        size = self.index["size"]
+        self.columns = {}
+        for col in COLUMNS:
+            if size == 0:
+                self.columns[col] = np.empty(0, dtype=np.float32)
+            else:
+                self.columns[col] = np.memmap(path.join(dataset_dir, f"{col}.f32"), dtype=np.float32, mode="r", shape=(size,))
+
+    def __len__(self):
+        return len(self.recordings)
+
+    def get_column(self, i: int, column="voltage"):
+        """
+        @returns: view of one column of the ith recording
+        """
+        rec = self.recordings[i]
+        return self.columns[column][rec["offset"]:rec["offset"] + rec["length"]]
+
+    def __getitem__(self, i: int):
+        data = np.vstack([ self.get_column(i, col) for col in COLUMNS ]).T
+        return data, self.recordings[i]["label"]
+
+
+def open_dataset(dataset_dir: str):
+    return Dataset(dataset_dir)
@@ -0,0 +1,121 @@
+"""
+Export models to TorchScript and cache them on disk, for fast loading and inference on the CPU
+
+The cached models are keyed by a hash of the model directory, so that a retrained model is exported again.
+"""
+import hashlib
+from os import path, environ, makedirs, walk
+
+try:
+    import torch
+
+    from teng_ml.util import model_io as mio
+except ImportError:
+    torch = None
+
+if 'XDG_CACHE_HOME' in environ.keys():
+    CACHE_DIR = environ["XDG_CACHE_HOME"] + "/m-teng/models"
+else:
+    CACHE_DIR = path.expanduser("~/.cache/m-teng/models")
+
+
+def hash_model_dir(model_dir: str) -> str:
+    """
+    @returns: sha256 hex digest over the names and contents of all files in model_dir
+    """
+    h = hashlib.sha256()
+    for root, dirs, files in walk(model_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            filepath = path.join(root, filename)
+            h.update(path.relpath(filepath, model_dir).encode())
+            with open(filepath, "rb") as file:
+                for block in iter(lambda: file.read(2**20), b""):
+                    h.update(block)
+    return h.hexdigest()
+
+
+def get_cache_path(model_dir: str, data_length: int, quantize=False) -> str:
+    # TorchScript files are not guaranteed to be compatible between torch versions
+    key = f"{hash_model_dir(model_dir)[:32]}-torch{torch.__version__}-{data_length}"
+    if quantize: key += "-int8"
+    return path.join(CACHE_DIR, key + ".pt")
+
+
+def _export(model_dir: str, data_length: int, quantize=False):
+    """
+    Load the model with teng_ml, append the softmax and trace it
+    """
+    class WithSoftmax(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, x):
+            # TODO remove when softmax is already applied by model
+            return torch.nn.functional.softmax(self.model(x), dim=1)
+
+    model = mio.load_model(model_dir)
+    model.eval()
+    if quantize:
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU}, dtype=torch.qint8)
+    model = WithSoftmax(model)
+    model.eval()
+    example = torch.zeros((1, data_length, 1), dtype=torch.float32)  # batch_size, seq, features
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    return torch.jit.freeze(traced)
+
+
+def _load_eager(model_dir: str):
+    model = mio.load_model(model_dir)
+    model.eval()
+    return lambda x: torch.nn.functional.softmax(model(x), dim=1)
+
+
+def _validate(model, data_length: int):
+    """
+    Run the model once with an input of the real length, a traced model may be specialized on the shape
+    """
+    with torch.inference_mode():
+        model(torch.zeros((1, data_length, 1), dtype=torch.float32))
+
+
+def load_model(model_dir: str, data_length: int, quantize=False, use_cache=True, verbose=True):
+    """
+    Load a model as TorchScript module that returns the label probabilities
+
+    @details
+        On the first call for a model, it is exported to TorchScript and stored in CACHE_DIR.
+        Later calls load the exported model, which skips unpickling the model and its python code.
+        If the model can not be traced or the traced model fails on an input of data_length, the eager model is used instead.
+    @param model_dir: directory where model.plk and settings.pkl are stored
+    @param data_length: length of the input sequence, the traced model only accepts this length
+    @param quantize: apply dynamic int8 quantization to Linear, LSTM and GRU layers
+    @returns: module: (batch_size, data_length, 1) -> (batch_size, label-probabilities)
+    """
+    if torch is None:
+        raise ImportError("load_model requires torch and teng_ml")
+    cache_path = get_cache_path(model_dir, data_length, quantize=quantize)
+    if use_cache and path.isfile(cache_path):
+        if verbose: print(f"Loading cached model '{cache_path}'")
+        try:
+            model = torch.jit.load(cache_path, map_location="cpu")
+            model.eval()
+            _validate(model, data_length)
+            return model
+        except Exception as e:
+            print(f"load_model: Cached model '{cache_path}' failed, using eager model: {e}")
+            return _load_eager(model_dir)
+    try:
+        model = _export(model_dir, data_length, quantize=quantize)
+        _validate(model, data_length)
+    except Exception as e:
+        print(f"load_model: Could not export model to TorchScript, using eager model: {e}")
+        return _load_eager(model_dir)
+    if use_cache:
+        if not path.isdir(CACHE_DIR):
+            makedirs(CACHE_DIR)
+        torch.jit.save(model, cache_path)
+        if verbose: print(f"Cached model as '{cache_path}'")
+    return model
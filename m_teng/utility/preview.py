@@ -0,0 +1,130 @@
+"""
+Render preview images for a directory of recordings in parallel
+
+Usage:
+    python -m m_teng.utility.preview ~/data/session1
+or as script: m-teng-preview ~/data/session1
+"""
+import argparse
+import html
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from os import path, makedirs
+
+import numpy as np
+
+PREVIEW_DIR = "previews"
+
+
+def decimate(x, y, max_points=2000):
+    """
+    Reduce the number of points by keeping the minimum and maximum of each bucket, which preserves the peaks
+    @returns: x, y with at most max_points points
+    """
+    n = len(y)
+    if n <= max_points: return x, y
+    n_buckets = max_points // 2
+    # evenly spaced edges, so the buckets differ by at most one sample
+    edges = np.linspace(0, n, n_buckets + 1).astype(int)
+    size = np.max(np.diff(edges))
+    # indices of the samples of each bucket, shorter buckets repeat their last sample
+    ib = np.minimum(edges[:-1,None] + np.arange(size), edges[1:,None] - 1)
+    yb = y[ib]
+    rows = np.arange(n_buckets)
+    i_min = ib[rows, np.argmin(yb, axis=1)]
+    i_max = ib[rows, np.argmax(yb, axis=1)]
+    indices = np.sort(np.concatenate((i_min, i_max)))
+    return x[indices], y[indices]
+
+
+def _render(data_path, png_path, max_points):
+    # import here, the workers must select the Agg backend before pyplot is imported
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from m_teng.utility.data import load_dataframe
+
+    df = load_dataframe(data_path)
+    if df is None: return None
+    data = df.to_numpy()
+    fig, (vax, iax) = plt.subplots(2, 1, figsize=(8, 5), sharex=True)
+    vax.plot(*decimate(data[:,0], data[:,2], max_points), color="g", linewidth=0.8)
+    vax.set_ylabel("Voltage [V]")
+    vax.grid(True)
+    iax.plot(*decimate(data[:,0], data[:,1], max_points), color="m", linewidth=0.8)
+    iax.set_ylabel("Current [A]")
+    iax.set_xlabel("t [s]")
+    iax.grid(True)
+    fig.suptitle(path.basename(data_path))
+    fig.savefig(png_path, dpi=80)
+    plt.close(fig)
+    return png_path
+
+
+def _write_index(out_dir, entries):
+    lines = ["<!DOCTYPE html>", "<html><head><meta charset='utf-8'><title>m-teng previews</title></head><body>"]
+    for data_path, png_path in entries:
+        name = html.escape(path.basename(data_path))
+        png = html.escape(path.relpath(png_path, out_dir))
+        lines.append(f"<div><h3>{name}</h3><a href='{png}'><img src='{png}' width='640'></a></div>")
+    lines.append("</body></html>")
+    index_path = path.join(out_dir, "index.html")
+    with open(index_path, "w") as file:
+        file.write("\n".join(lines))
+    return index_path
+
+
+def render_previews(directory, out_dir=None, n_workers=None, max_points=2000, force=False, verbose=True):
+    """
+    Render a png preview for every csv and pkl file in directory and write an index.html linking them
+
+    @param out_dir: output directory, defaults to 'directory/previews'
+    @param n_workers: number of processes, None means the number of cpus
+    @param max_points: maximum number of points per plotted line
+    @param force: also render previews that are newer than their recording
+    @returns: path of index.html
+    """
+    if out_dir is None: out_dir = path.join(directory, PREVIEW_DIR)
+    if not path.isdir(out_dir):
+        makedirs(out_dir)
+    data_paths = sorted(glob(path.join(directory, "*.csv")) + glob(path.join(directory, "*.pkl")))
+    entries = []
+    todo = []
+    for data_path in data_paths:
+        png_path = path.join(out_dir, path.basename(data_path) + ".png")
+        entries.append((data_path, png_path))
+        if force or not path.isfile(png_path) or path.getmtime(png_path) < path.getmtime(data_path):
+            todo.append((data_path, png_path))
+    if verbose: print(f"Rendering {len(todo)} previews, {len(entries) - len(todo)} are up to date")
+    failed = set()
+    # spawn, since forking a process with an interactive matplotlib backend can hang
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context("spawn")) as executor:
+        futures = { executor.submit(_render, data_path, png_path, max_points): data_path for data_path, png_path in todo }
+        for future, data_path in futures.items():
+            try:
+                if future.result() is None: failed.add(data_path)
+            except Exception as e:
+                print(f"ERROR: render_previews: Could not render '{data_path}': {e}")
+                failed.add(data_path)
+    index_path = _write_index(out_dir, [ e for e in entries if e[0] not in failed ])
+    if verbose: print(f"Saved index as '{index_path}'")
+    return index_path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="m-teng-preview",
+        description="render preview images for a directory of recordings",
+    )
+    parser.add_argument("directory", help="directory with csv or pkl recordings")
+    parser.add_argument("-o", "--output", action="store", help="output directory, defaults to <directory>/previews")
+    parser.add_argument("-j", "--jobs", action="store", type=int, help="number of processes")
+    parser.add_argument("-n", "--max-points", action="store", type=int, default=2000, help="maximum number of points per plotted line")
+    parser.add_argument("-f", "--force", action="store_true", help="render all previews, even if they are up to date")
+    args = parser.parse_args()
+    render_previews(path.expanduser(args.directory), out_dir=args.output, n_workers=args.jobs, max_points=args.max_points, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
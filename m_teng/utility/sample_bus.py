@@ -0,0 +1,196 @@
+"""
+Shared memory ring buffer that decouples the acquisition from plotting, printing and saving
+
+The acquisition process publishes samples with SampleBus.update, which can be passed as update_func
+to any measure function. Consumers run in their own processes and read the samples through a BusReader
+with their own cursor, so a slow consumer never delays the polling of the instrument.
+
+There is exactly one writer, so no locks are needed: the writer stores the sample first and increments
+the write counter afterwards. Readers only ever read samples below the write counter. They copy the samples
+and check the counter again afterwards, samples that were overwritten during the copy are dropped.
+"""
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from time import sleep
+
+import numpy as np
+
+# header: write counter, closed flag, capacity
+_HEADER_SIZE = 3
+_COLUMNS = 3  # index, current, voltage
+
+# spawn, since forking a process with an interactive matplotlib backend can hang.
+# The consumer factories must therefore be picklable, eg a class or functools.partial
+_mp_context = mp.get_context("spawn")
+
+
+def _layout(shm: shared_memory.SharedMemory, capacity: int):
+    header = np.ndarray((_HEADER_SIZE,), dtype=np.int64, buffer=shm.buf)
+    data = np.ndarray((capacity, _COLUMNS), dtype=np.float64, buffer=shm.buf, offset=header.nbytes)
+    return header, data
+
+
+class SampleBus:
+    """
+    Writing side of the bus, lives in the acquisition process
+    @param capacity: number of samples the ring buffer holds. Consumers that fall further behind lose samples
+    """
+    def __init__(self, capacity=2**16):
+        self.capacity = capacity
+        size = 8 * _HEADER_SIZE + 8 * _COLUMNS * capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.name = self.shm.name
+        self.header, self.data = _layout(self.shm, capacity)
+        self.header[:] = (0, 0, capacity)
+        self.consumers = []
+
+    def update(self, i, ival, vval):
+        """
+        Publish a sample. Has the signature of an update_func
+        """
+        n = self.header[0]
+        self.data[n % self.capacity] = (i, ival, vval)
+        self.header[0] = n + 1
+
+    def start_consumer(self, factory, poll_interval=0.05, timeout=30):
+        """
+        Start a consumer process
+        @param factory: picklable Callable that is called in the new process and returns the consumer.
+            The consumer needs an update(i, ival, vval) method. If it has update_many(data), that is called with
+            all new samples at once instead (2D array: index, current, voltage). If it has close(), that is called
+            when the bus is closed.
+        @param poll_interval: time in seconds the consumer sleeps when there are no new samples
+        @param timeout: maximum time in seconds to wait until the consumer is ready. Starting a process takes a while,
+            and samples published before would be lost if the ring buffer wraps around in the meantime
+        """
+        ready = _mp_context.Event()
+        process = _mp_context.Process(target=_run_consumer, args=(self.name, factory, poll_interval, ready), daemon=True)
+        process.start()
+        self.consumers.append(process)
+        if not ready.wait(timeout):
+            print(f"SampleBus: consumer was not ready after {timeout}s")
+        return process
+
+    def close(self, timeout=5):
+        """
+        Signal the consumers that no more samples will follow, wait for them and free the shared memory
+        """
+        self.header[1] = 1
+        for process in self.consumers:
+            process.join(timeout=timeout)
+            if process.is_alive():
+                process.terminate()
+        self.consumers.clear()
+        del self.header, self.data
+        self.shm.close()
+        self.shm.unlink()
+
+
+class BusReader:
+    """
+    Reading side of the bus, lives in a consumer process
+    @param name: name of the shared memory of the SampleBus
+    """
+    def __init__(self, name):
+        self.shm = shared_memory.SharedMemory(name=name)
+        capacity = int(np.ndarray((_HEADER_SIZE,), dtype=np.int64, buffer=self.shm.buf)[2])
+        self.header, self.data = _layout(self.shm, capacity)
+        self.capacity = capacity
+        self.cursor = 0
+        self.n_lost = 0
+
+    @property
+    def closed(self):
+        return self.header[1] != 0
+
+    def read(self):
+        """
+        Get all samples that were published since the last read
+        @returns list with a 2D array of the new samples or an empty list.
+            The samples are copied, samples that the writer overwrote while copying are dropped and counted as lost.
+        """
+        n = int(self.header[0])
+        if n - self.cursor > self.capacity:
+            # the consumer fell behind and the oldest samples were already overwritten
+            self.n_lost += n - self.cursor - self.capacity
+            self.cursor = n - self.capacity
+        if n == self.cursor:
+            return []
+        start = self.cursor
+        data = self.data[np.arange(start, n) % self.capacity]
+        self.cursor = n
+        # the writer stores sample k before incrementing the counter to k+1, so it might be overwriting sample k - capacity
+        first_valid = int(self.header[0]) + 1 - self.capacity
+        if first_valid > start:
+            n_overwritten = min(first_valid - start, len(data))
+            self.n_lost += n_overwritten
+            data = data[n_overwritten:]
+        return [data] if len(data) > 0 else []
+
+    def close(self):
+        del self.header, self.data
+        self.shm.close()
+
+
+def _consume(reader, consumer, poll_interval):
+    update_many = getattr(consumer, "update_many", None)
+    while True:
+        # check before reading so that the samples published right before closing are not missed
+        closed = reader.closed
+        chunks = reader.read()
+        for chunk in chunks:
+            if update_many is not None:
+                update_many(chunk)
+            else:
+                for row in chunk:
+                    consumer.update(int(row[0]), row[1], row[2])
+        if closed: break
+        if not chunks: sleep(poll_interval)
+
+
+def _run_consumer(name, factory, poll_interval, ready):
+    reader = BusReader(name)
+    try:
+        consumer = factory()
+    finally:
+        ready.set()
+    try:
+        _consume(reader, consumer, poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if reader.n_lost > 0:
+            print(f"SampleBus: consumer {type(consumer).__name__} lost {reader.n_lost} samples")
+        if hasattr(consumer, "close"):
+            consumer.close()
+        reader.close()
+
+
+class CsvWriter:
+    """
+    Consumer that appends the samples to a csv file
+    """
+    def __init__(self, filepath):
+        self.file = open(filepath, "w")
+        self.file.write("Index,Current [A],Voltage [V]\n")
+
+    def update(self, i, ival, vval):
+        self.file.write(f"{i},{ival},{vval}\n")
+
+    def update_many(self, data):
+        np.savetxt(self.file, data, delimiter=",", fmt=["%d", "%.12g", "%.12g"])
+
+    def close(self):
+        self.file.close()
+
+
+class Printer:
+    """
+    Consumer that prints the newest sample
+    """
+    def update(self, i, ival, vval):
+        from m_teng.update_funcs import _update_print
+        _update_print(i, ival, vval)
+
+    def update_many(self, data):
+        self.update(int(data[-1, 0]), data[-1, 1], data[-1, 2])
@@ -0,0 +1,129 @@
+"""
+High resolution timestamps and synchronization of device clocks with the host clock
+
+All host times are seconds of the monotonic clock, which does not jump when the system time changes.
+monotonic_to_unix converts them to unix timestamps.
+
+A ClockSync maps the timestamps of a device to host time:
+    host = offset + rate * device
+It is estimated from round trips: the host notes the time before and after asking the device for its time.
+The device time belongs to the midpoint of the round trip, with an uncertainty of half the round trip time.
+Only the fastest round trips of each batch of samples are used for the fit (the lower envelope of the delays),
+since slow round trips were delayed at an unknown point. Batches at the start and end of a measurement give the drift.
+"""
+from time import monotonic_ns, time_ns
+
+import numpy as np
+
+
+def now() -> float:
+    """
+    @returns: host time in seconds
+    """
+    return monotonic_ns() * 1e-9
+
+
+def _get_unix_offset(n=5):
+    # take the pair of readings that are closest together
+    best = None
+    for _ in range(n):
+        t0 = monotonic_ns()
+        unix = time_ns()
+        t1 = monotonic_ns()
+        if best is None or t1 - t0 < best[0]:
+            best = (t1 - t0, unix - (t0 + t1) // 2)
+    return best[1] * 1e-9
+
+# unix time - monotonic time, determined once so that the conversion does not jump with the system time
+_unix_offset = _get_unix_offset()
+
+
+def monotonic_to_unix(t):
+    """
+    Works with scalars and arrays
+    @param t: host time in seconds
+    @returns: unix timestamp in seconds
+    """
+    return t + _unix_offset
+
+
+class ClockSync:
+    """
+    @param offset: host time at device time 0
+    @param rate: host seconds per device second
+    """
+    def __init__(self, offset=0.0, rate=1.0):
+        self.offset = offset
+        self.rate = rate
+        self.samples = []  # (host time before the query, device time, host time after the query, batch)
+        self.n_batches = 0
+
+    def add(self, t_send, t_device, t_receive, batch=0):
+        self.samples.append((t_send, t_device, t_receive, batch))
+
+    def measure(self, query_time, n=10):
+        """
+        Add a batch of n round trip samples
+        @param query_time: Callable that returns the device time: () -> float
+        """
+        batch = self.n_batches
+        self.n_batches += 1
+        for _ in range(n):
+            t_send = now()
+            t_device = query_time()
+            self.add(t_send, t_device, now(), batch)
+
+    def fit(self, fraction=0.5):
+        """
+        Estimate offset and rate from the samples
+        @param fraction: fraction of the fastest round trips of each batch that are used
+        @returns: self
+        """
+        if not self.samples: raise ValueError("No samples to fit")
+        samples = np.array(self.samples)
+        rtt = samples[:,2] - samples[:,0]
+        keep = np.zeros(len(samples), dtype=bool)
+        for batch in np.unique(samples[:,3]):
+            in_batch = samples[:,3] == batch
+            keep |= in_batch & (rtt <= np.quantile(rtt[in_batch], fraction))
+        t_device = samples[keep,1]
+        t_host = 0.5 * (samples[keep,0] + samples[keep,2])
+        if len(np.unique(samples[:,3])) < 2 or np.ptp(t_device) == 0:
+            # a single batch spans too little time to estimate the drift
+            self.rate = 1.0
+            self.offset = float(np.mean(t_host - t_device))
+        else:
+            self.rate, self.offset = (float(c) for c in np.polyfit(t_device, t_host, 1))
+        return self
+
+    @property
+    def drift(self):
+        """
+        @returns: drift of the device clock relative to the host clock in parts per million
+        """
+        return (self.rate - 1.0) * 1e6
+
+    @property
+    def uncertainty(self):
+        """
+        @returns: half of the fastest round trip time, in seconds. 0 without samples
+        """
+        if not self.samples: return 0.0
+        return 0.5 * min(t_receive - t_send for t_send, _, t_receive, _ in self.samples)
+
+    def to_host(self, t_device):
+        """
+        Works with scalars and arrays
+        @returns: host time in seconds
+        """
+        return self.offset + self.rate * t_device
+
+    def to_unix(self, t_device):
+        """
+        Works with scalars and arrays
+        @returns: unix timestamp in seconds
+        """
+        return monotonic_to_unix(self.to_host(t_device))
+
+    def __repr__(self):
+        return f"ClockSync(offset={self.offset:.6f}s, drift={self.drift:.1f}ppm, uncertainty={self.uncertainty*1e6:.0f}us, {len(self.samples)} samples)"
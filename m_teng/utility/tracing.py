@@ -0,0 +1,115 @@
+"""
+Record timed spans of a measurement session and export them in the Chrome trace event format
+
+The exported file can be opened with https://ui.perfetto.dev or chrome://tracing.
+Tracing is disabled by default, then span() returns a context manager that does nothing.
+
+Usage:
+    with tracing.span("poll", "keithley"):
+        instr.query(...)
+"""
+import json
+import threading
+from contextlib import nullcontext
+from os import getpid
+from time import perf_counter_ns
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.pid = getpid()
+
+    def start(self):
+        self.events = []
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def add(self, name, cat, t_start_ns, t_end_ns, args=None):
+        event = {
+            "name": name,
+            "cat":  cat,
+            "ph":   "X",
+            "ts":   t_start_ns / 1000,  # microseconds
+            "dur":  (t_end_ns - t_start_ns) / 1000,
+            "pid":  self.pid,
+            "tid":  threading.get_ident(),
+        }
+        if args: event["args"] = args
+        self.events.append(event)
+
+    def export(self, filepath):
+        """
+        Write the recorded spans as Chrome trace json
+        """
+        thread_names = { t.ident: t.name for t in threading.enumerate() }
+        metadata = [ { "name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": { "name": thread_names.get(tid, str(tid)) } }
+                     for tid in { e["tid"] for e in self.events } ]
+        with open(filepath, "w") as file:
+            json.dump({ "traceEvents": metadata + self.events, "displayTimeUnit": "ms" }, file)
+
+_tracer = Tracer()
+
+
+class _Span:
+    __slots__ = ("name", "cat", "args", "t_start")
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.t_start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _tracer.add(self.name, self.cat, self.t_start, perf_counter_ns(), self.args)
+        return False
+
+_null_span = nullcontext()
+
+
+def span(name: str, cat: str="m-teng", **args):
+    """
+    @returns: context manager that records the time spent inside it, if tracing is enabled
+    """
+    if not _tracer.enabled: return _null_span
+    return _Span(name, cat, args)
+
+
+def traced(func, name: str, cat: str="update_func"):
+    """
+    Wrap a callable, eg an update_func, so that every call is recorded as span
+    """
+    if func is None: return None
+    def wrapper(*args, **kwargs):
+        with span(name, cat):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def start():
+    """
+    Start recording spans, discarding previously recorded ones
+    """
+    _tracer.start()
+
+
+def stop():
+    _tracer.stop()
+
+
+def is_enabled():
+    return _tracer.enabled
+
+
+def export(filepath: str):
+    """
+    Write the recorded spans to filepath
+    @returns: number of recorded spans
+    """
+    _tracer.export(filepath)
+    return len(_tracer.events)
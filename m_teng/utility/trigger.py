@@ -0,0 +1,172 @@
+"""
+Triggered capture: keep only the segments around trigger events instead of the whole recording
+
+A segment consists of <pre> samples before the trigger sample and <post> samples starting with the trigger sample.
+Triggers that occur within the post-trigger window of a segment are ignored.
+"""
+from collections import deque
+from datetime import datetime
+from os import path
+from time import time
+
+import numpy as np
+
+from m_teng.utility import file_io
+from m_teng.utility.data import write_csv
+
+COLUMNS = {"I": 1, "V": 2}
+
+
+class Trigger:
+    """
+    @param channel: "V" for voltage or "I" for current
+    @param mode: "threshold": trigger when the value crosses level
+                 "slope": trigger when the difference between two consecutive values exceeds level
+    @param level: threshold in V or A, or slope in V or A per sample
+    @param direction: "rising", "falling" or "both"
+    """
+    def __init__(self, channel="V", mode="threshold", level=1.0, direction="rising"):
+        if channel not in COLUMNS: raise ValueError(f"Invalid channel: '{channel}', must be 'V' or 'I'")
+        if mode not in ["threshold", "slope"]: raise ValueError(f"Invalid mode: '{mode}', must be 'threshold' or 'slope'")
+        if direction not in ["rising", "falling", "both"]: raise ValueError(f"Invalid direction: '{direction}', must be 'rising', 'falling' or 'both'")
+        self.channel = channel
+        self.column = COLUMNS[channel]
+        self.mode = mode
+        self.level = level
+        self.direction = direction
+
+    def fires(self, prev, values):
+        """
+        Works with scalars and arrays
+        @param prev: previous value(s)
+        @param values: current value(s)
+        @returns: whether the trigger fires at values
+        """
+        if self.mode == "threshold":
+            rising = (prev < self.level) & (values >= self.level)
+            falling = (prev > self.level) & (values <= self.level)
+        else:
+            rising = (values - prev) >= self.level
+            falling = (prev - values) >= self.level
+        if self.direction == "rising": return rising
+        if self.direction == "falling": return falling
+        return rising | falling
+
+    def find(self, values):
+        """
+        @param values: 1D array
+        @returns: indices of all samples where the trigger fires
+        """
+        values = np.asarray(values)
+        return np.nonzero(self.fires(values[:-1], values[1:]))[0] + 1
+
+
+class Segment:
+    def __init__(self, data, trigger_index, t_trigger):
+        """
+        @param data: 2D array: timestamps, current, voltage
+        @param trigger_index: index of the trigger sample in the whole recording
+        @param t_trigger: absolute time of the trigger sample, as unix timestamp
+        """
+        self.data = data
+        self.trigger_index = trigger_index
+        self.t_trigger = t_trigger
+
+
+def find_segments(data, trigger: Trigger, pre=100, post=400, t_start=None):
+    """
+    Find the triggered segments in a whole recording
+
+    @param data: 2D array: timestamps in s, current, voltage
+    @param t_start: absolute time of timestamp 0, as unix timestamp. None means now
+    @returns: list of Segment
+    """
+    if t_start is None: t_start = time()
+    segments = []
+    end = 0  # first sample after the last segment
+    for k in trigger.find(data[:,trigger.column]):
+        if k < end: continue
+        end = k + post
+        segments.append(Segment(data[max(k - pre, 0):end], int(k), t_start + data[k,0]))
+    return segments
+
+
+class TriggeredCapture:
+    """
+    Live triggered capture, use update as update_func
+
+    @details
+        Keeps the last <pre> samples in a ring buffer. When the trigger fires, they are copied to the new
+        segment, which is then filled with the next <post> samples.
+        The timestamps are the host times when update was called, relative to the trigger.
+    """
+    def __init__(self, trigger: Trigger, pre=100, post=400, verbose=True):
+        self.trigger = trigger
+        self.pre = pre
+        self.post = post
+        self.verbose = verbose
+        self.ring = deque(maxlen=pre)
+        self.prev = None
+        self.current = None  # samples of the segment that is being filled
+        self.n_post = 0
+        self.trigger_index = 0
+        self.t_trigger = 0
+        self.segments = []
+
+    def update(self, i, ival, vval):
+        t = time()
+        sample = (t, ival, vval)
+        value = sample[self.trigger.column]
+        if self.current is not None:
+            self.current.append(sample)
+            self.n_post += 1
+            if self.n_post >= self.post:
+                self._finish()
+        elif self.prev is not None and self.trigger.fires(self.prev, value):
+            self.current = list(self.ring)
+            self.current.append(sample)
+            self.n_post = 1
+            self.trigger_index = i
+            self.t_trigger = t
+            if self.verbose:
+                print(f"Triggered at n = {i} ({len(self.segments)+1} segments)" + " "*30)
+            if self.n_post >= self.post:
+                self._finish()
+        self.ring.append(sample)
+        self.prev = value
+
+    def _finish(self):
+        data = np.array(self.current)
+        data[:,0] -= self.t_trigger
+        self.segments.append(Segment(data, self.trigger_index, self.t_trigger))
+        self.current = None
+
+    def flush(self):
+        """
+        Finish the current segment, even if it has less than <post> samples
+        @returns: list of all Segment
+        """
+        if self.current is not None:
+            self._finish()
+        return self.segments
+
+
+def save_segments(segments, directory, name):
+    """
+    Save each segment as csv file 'directory/nameXXX.csv' and list them in 'directory/name_triggers.csv'
+    with the absolute time of the trigger
+    @returns: list of filepaths
+    """
+    index_path = path.join(directory, f"{name}_triggers.csv")
+    new_index = not path.isfile(index_path)
+    filepaths = []
+    with open(index_path, "a") as index_file:
+        if new_index:
+            index_file.write("File,Trigger Index,Trigger Time\n")
+        for segment in segments:
+            basename = file_io.get_next_filename(name, directory)
+            filepath = path.join(directory, basename + ".csv")
+            write_csv(segment.data, filepath)
+            index_file.write(f"{basename}.csv,{segment.trigger_index},{datetime.fromtimestamp(segment.t_trigger).isoformat()}\n")
+            filepaths.append(filepath)
+    return filepaths
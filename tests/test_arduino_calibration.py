@@ -0,0 +1,19 @@
+import numpy as np
+
+from m_teng.backends.arduino.calibration import Calibration, fit
+
+
+def test_calibration_from_arrays():
+    c = Calibration(gain=2.0, offset=1.0, poly=np.array([0.5]))
+    assert c.poly == [0.5]
+    assert c.apply(2.0) == 1.0 + 4.0 + 2.0
+    c = Calibration(lut=np.array([[10, 1.0], [0, 0.0]]))
+    assert np.allclose(c.apply(np.array([0, 5, 10])), [0.0, 0.5, 1.0])
+    c = Calibration(poly=np.array([]), lut=np.zeros((0, 2)))
+    assert c.poly == [] and c.lut is None
+
+
+def test_fit_round_trip():
+    raw = np.arange(0, 4096, 256)
+    c = fit(raw, 0.1 + 1e-3 * raw + 1e-8 * raw**2, degree=2)
+    assert np.allclose(Calibration.from_dict(c.to_dict()).apply(raw), c.apply(raw))
@@ -0,0 +1,69 @@
+import numpy as np
+
+from m_teng.backends.arduino import arduino, measure
+from m_teng.backends.arduino.sequence import SEQ_MODULO, SequenceTracker, parse_records
+from m_teng.backends.arduino.testing import FakeBleakClient
+
+
+def test_parse_records():
+    payload = bytearray((5).to_bytes(2, "little") + (4095).to_bytes(2, "little") + (6).to_bytes(2, "little") + (0).to_bytes(2, "little"))
+    assert parse_records(payload) == [(5, 4095), (6, 0)]
+
+
+def test_tracker_wrap():
+    tracker = SequenceTracker()
+    assert tracker.add(SEQ_MODULO - 3) == (SEQ_MODULO - 3, SEQ_MODULO - 3)
+    assert tracker.add(SEQ_MODULO - 1) == (SEQ_MODULO - 1, 1)
+    # sequence number wraps around, the index continues
+    assert tracker.add(0) == (SEQ_MODULO, 0)
+    assert tracker.add(3) == (SEQ_MODULO + 3, 2)
+    # duplicates from before the wrap
+    assert tracker.add(SEQ_MODULO - 1) == (None, 0)
+    assert tracker.add(0) == (None, 0)
+    s = tracker.stats()
+    assert s["lost"] == SEQ_MODULO - 3 + 1 + 2
+    assert s["duplicates"] == 2
+    assert s["received"] == 4
+
+
+def test_tracker_resume():
+    tracker = SequenceTracker()
+    for seq in range(10):
+        tracker.add(seq)
+    # the device restarts its sequence numbers after a reconnect
+    tracker.resume()
+    assert tracker.add(0) == (10, 0)
+    assert tracker.add(2) == (12, 1)
+    # the sequence numbers are relative to the resume point, also across the wrap
+    tracker.resume()
+    assert tracker.add(SEQ_MODULO - 1) == (13 + SEQ_MODULO - 1, SEQ_MODULO - 1)
+    assert tracker.add(0) == (13 + SEQ_MODULO, 0)
+    assert tracker.stats()["lost"] == 1 + SEQ_MODULO - 1
+
+
+def test_measure_count_lossy_link():
+    client = FakeBleakClient(sequenced=True, p_drop=0.05, p_duplicate=0.05, p_merge=0.2, seed=3)
+    count = 300
+    measure.measure_count(client, count=count, interval=0.005, update_interval=0.1, beep_done=False, verbose=False, sequenced=True)
+    dropped = sorted(set(client.sent) - set(client.delivered))
+    assert len(dropped) > 0
+    stats = arduino._buffer.stats
+    assert stats["lost"] == len(dropped)
+    assert stats["received"] == count - len(dropped)
+    assert stats["duplicates"] > 0
+    assert stats["merged"] > 0
+    lost_rows = np.nonzero(np.isnan(arduino._buffer.data[:,2]))[0]
+    assert list(lost_rows) == dropped
+
+
+def test_measure_lossy_link():
+    client = FakeBleakClient(sequenced=True, p_drop=0.05, p_duplicate=0.05, p_merge=0.2, seed=4)
+    measure.measure(client, 0.005, max_measurements=300, sequenced=True)
+    data = arduino._buffer.data
+    # samples lost after the last received one can not be detected
+    n = len(data)
+    dropped = [ seq for seq in set(client.sent) - set(client.delivered) if seq < n ]
+    assert len(dropped) > 0
+    assert arduino._buffer.stats["lost"] == len(dropped)
+    assert list(np.nonzero(np.isnan(data[:,2]))[0]) == sorted(dropped)
+    assert np.isnan(data[sorted(dropped),0]).all()
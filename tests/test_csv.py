@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from m_teng.utility import data
+
+
+@pytest.mark.parametrize("engine,options", [ ("c", { "float_precision": "round_trip" }), (data._csv_engine, data._csv_options) ])
+@pytest.mark.parametrize("extended", [ data._EXTENDED_PRECISION, False ])
+def test_write_csv_lossless(tmp_path, monkeypatch, engine, options, extended):
+    monkeypatch.setattr(data, "_csv_engine", engine)
+    monkeypatch.setattr(data, "_csv_options", options)
+    # without extended precision, the digits are computed in double-double arithmetic
+    monkeypatch.setattr(data, "_EXTENDED_PRECISION", extended)
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((10000, 3)) * 10.0 ** rng.integers(-300, 300, (10000, 3))
+    x[:10,0] = 10.0 ** np.arange(-5, 5)
+    x[10:20,1] = np.nextafter(x[:10,0], 0)
+    x[20,:] = [0.0, -0.0, 0.1]
+    x[21,:] = [5e-324, -2.2250738585072014e-308, 1.7976931348623157e308]
+    p = str(tmp_path / "x.csv")
+    data.write_csv(x, p)
+    r = data.read_csv(p).to_numpy()
+    assert np.array_equal(r, x)
+    assert np.array_equal(np.signbit(r), np.signbit(x))
+
+
+@pytest.mark.parametrize("engine,options", [ ("c", { "float_precision": "round_trip" }), (data._csv_engine, data._csv_options) ])
+def test_write_csv_special_values(tmp_path, monkeypatch, engine, options):
+    monkeypatch.setattr(data, "_csv_engine", engine)
+    monkeypatch.setattr(data, "_csv_options", options)
+    x = np.array([[1.0, np.nan, -2.5], [np.inf, 5e-324, -np.inf], [0.5, 2.0, 3.0]])
+    p = str(tmp_path / "x.csv")
+    data.write_csv(x, p)
+    with open(p) as file:
+        assert file.read().splitlines()[1:] == ["1.0e+00,,-2.5e+00", "inf,4.9406564584124654e-324,-inf", "5.0e-01,2.0e+00,3.0e+00"]
+    assert np.array_equal(data.read_csv(p).to_numpy(), x, equal_nan=True)
+
+
+@pytest.mark.parametrize("precision", [ 0, 18 ])
+def test_invalid_precision(tmp_path, precision):
+    with pytest.raises(ValueError):
+        data.format_csv_rows(np.ones((2, 3)), precision)
+    with pytest.raises(ValueError):
+        data.write_csv(np.ones((2, 3)), str(tmp_path / "x.csv"), precision=precision)
@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from m_teng import headless
+
+
+def _write(tmp_path, content):
+    p = tmp_path / "jobs.json"
+    p.write_text(json.dumps(content))
+    return str(p)
+
+
+def test_load_jobs(tmp_path):
+    jobs = headless.load_jobs(_write(tmp_path, { "backend": "arduino", "count": 10, "jobs": [ { "name": "a" }, { "name": "b", "count": 20 } ] }))
+    assert [ (j["name"], j["count"], j["backend"]) for j in jobs ] == [ ("a", 10, "arduino"), ("b", 20, "arduino") ]
+    assert len(headless.load_jobs(_write(tmp_path, { "backend": "keithley" }))) == 1
+
+
+@pytest.mark.parametrize("content", [
+    { "backend": "keithley", "jobs": [] },
+    { "backend": "keithley", "jobs": {} },
+    { "jobs": [ { "name": "a" } ] },
+    { "backend": "keithley", "jobs": [ { "name": "a" }, { "name": "b", "backend": "arduino" } ] },
+    { "backend": "keithley", "jobs": [ 1 ] },
+    { "backend": "serial" },
+    { "backend": "keithley", "count": 0 },
+    { "backend": "keithley", "interval": "fast" },
+    { "backend": "keithley", "colour": "red" },
+    [ { "backend": "keithley" } ],
+])
+def test_invalid_job_file(tmp_path, capsys, content):
+    path = _write(tmp_path, content)
+    with pytest.raises(ValueError):
+        headless.load_jobs(path)
+    assert headless.run_jobfile(path) == 1
+    assert "Invalid job file" in capsys.readouterr().out
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from m_teng.utility import data
+
+
+@pytest.fixture
+def recordings(tmp_path):
+    paths = []
+    for n in range(4):
+        p = tmp_path / f"r{n}.csv"
+        data.write_csv(np.full((100, 3), float(n)), str(p))
+        paths.append(str(p))
+    data._cache.clear()
+    yield paths
+    data._cache.clear()
+    data.set_cache_size(512 * 2**20)
+
+
+def test_load_many(recordings):
+    df = data.load_many(recordings)
+    assert len(df) == 400
+    assert list(df["Recording"].unique()) == ["r0", "r1", "r2", "r3"]
+
+
+def test_load_many_hits_evicted_while_loading(recordings):
+    nbytes = int(data.load_dataframe(recordings[0]).memory_usage(index=True, deep=False).sum())
+    data.set_cache_size(int(2.5 * nbytes))
+    data.load_many(recordings[2:])
+    # r2 and r3 are cached, loading r0 and r1 evicts them before they are yielded
+    results = list(data.load_many(recordings, lazy=True))
+    assert [ p for p, _ in results ] == recordings
+    for n, (_, df) in enumerate(results):
+        assert (df["Voltage [V]"] == n).all()
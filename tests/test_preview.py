@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from m_teng.utility.preview import decimate
+
+
+@pytest.mark.parametrize("n", [ 3999, 10_999, 4001 ])
+def test_decimate_density_and_peaks(n):
+    max_points = 2000
+    x = np.arange(n, dtype=float)
+    y = np.zeros(n)
+    peaks = { n // 2: 5.0, n // 2 + 7: -4.0, n - 3: 3.0, n - 1: -2.0, 0: 1.0 }
+    for i, v in peaks.items():
+        y[i] = v
+    xd, yd = decimate(x, y, max_points=max_points)
+    assert len(yd) <= max_points
+    assert np.all(np.diff(xd) >= 0)
+    for i, v in peaks.items():
+        assert i in xd and yd[xd == i][0] == v
+    # the points are spread evenly, also at the end of the trace
+    counts, _ = np.histogram(xd, bins=10, range=(0, n))
+    assert counts.min() >= 0.9 * counts.max()
+
+
+def test_decimate_short():
+    x = np.arange(10)
+    xd, yd = decimate(x, x * 2, max_points=20)
+    assert np.array_equal(xd, x)
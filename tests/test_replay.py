@@ -0,0 +1,32 @@
+import numpy as np
+
+from m_teng.backends.replay import measure, replay
+from m_teng.utility import data
+
+
+def _write(path, t):
+    x = np.vstack((t, np.zeros_like(t), np.arange(len(t), dtype=float))).T
+    x[np.isnan(t), 1:] = np.nan
+    data.write_csv(x, str(path))
+    return str(path)
+
+
+def test_load_recordings_with_nan_timestamps(tmp_path):
+    t = np.arange(10) * 0.1 + 5.0
+    t[[0, 4, 9]] = np.nan  # lost samples of a sequenced arduino recording
+    paths = [ _write(tmp_path / "a.csv", t), _write(tmp_path / "b.csv", np.arange(5) * 0.1) ]
+    data._cache.clear()
+    rec = replay.load_recordings(paths)
+    assert len(rec) == 15
+    times = rec[:,0][np.isfinite(rec[:,0])]
+    assert np.all(np.diff(times) > 0)
+    assert np.isclose(times[0], 0.0)
+    # the second recording continues one sample interval after the last finite timestamp of the first
+    assert np.isclose(rec[10,0], 0.7 + 0.1)
+
+    dev = replay.ReplayDevice(rec, speed=100)
+    values = []
+    measure.measure(dev, 0.1, update_func=lambda i, ival, vval: values.append(vval))
+    assert len(values) == 15
+    assert np.isclose(dev.stats["recorded_duration"], 1.2)
+    assert np.isclose(replay.get_sample_interval(dev), 0.1)
@@ -0,0 +1,61 @@
+import numpy as np
+
+from m_teng.utility.sample_bus import SampleBus, BusReader
+
+
+class _LappingData:
+    """
+    Ring buffer of a reader, the writer publishes <n> samples while the reader copies
+    """
+    def __init__(self, data, bus, n):
+        self.data = data
+        self.bus = bus
+        self.n = n
+
+    def __getitem__(self, indices):
+        copy = self.data[indices]
+        for _ in range(self.n):
+            k = self.bus.header[0]
+            self.bus.update(k, 0.0, float(k))
+        self.n = 0
+        return copy
+
+
+def _publish(bus, n):
+    for _ in range(n):
+        k = bus.header[0]
+        bus.update(k, 0.0, float(k))
+
+
+def test_read_copies():
+    bus = SampleBus(capacity=8)
+    reader = BusReader(bus.name)
+    try:
+        _publish(bus, 6)
+        chunks = reader.read()
+        _publish(bus, 7)
+        # the returned samples are not views of the ring buffer, which was overwritten
+        assert np.array_equal(chunks[0][:,2], np.arange(6))
+        # one less than the capacity, the writer can not be overwriting an unread sample yet
+        assert np.array_equal(reader.read()[0][:,2], np.arange(6, 13))
+        assert reader.n_lost == 0
+    finally:
+        reader.close()
+        bus.close()
+
+
+def test_read_drops_samples_overwritten_while_copying():
+    bus = SampleBus(capacity=8)
+    reader = BusReader(bus.name)
+    try:
+        _publish(bus, 8)
+        reader.data = _LappingData(reader.data, bus, 3)
+        data = reader.read()[0]
+        # samples 0 to 3 might have been overwritten by 8 to 11 (and 12 is being written)
+        assert np.array_equal(data[:,2], np.arange(4, 8))
+        assert reader.n_lost == 4
+        reader.data = reader.data.data
+        assert np.array_equal(reader.read()[0][:,2], np.arange(8, 11))
+    finally:
+        reader.close()
+        bus.close()